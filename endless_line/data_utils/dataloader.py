@@ -4,12 +4,61 @@ import git
 import pandas as pd
 from datetime import datetime, timedelta
 from sklearn.preprocessing import MinMaxScaler, LabelEncoder
-import boto3
-from botocore.config import Config
-from dotenv import load_dotenv
-import os
-from io import StringIO
 import numpy as np
+from endless_line.data_utils.table_cache import TableCache, SOURCE_DTYPES
+from endless_line.data_utils.pipeline_cache import PipelineCache
+from endless_line.data_utils.remote_store import get_store
+from endless_line.data_utils.weather_store import WeatherFeatureStore
+import hashlib
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Steps of the clean -> preprocess -> merge pipeline, in execution order:
+# (stage, step name, methods run, attributes produced, raw attributes read from source files).
+# A step is recomputed only when one of the source files of its raw attributes, or of
+# the steps it builds upon, changes.
+PIPELINE_SOURCES = {
+	"link_attraction_park": ("link_attraction_park.csv", {"sep": ";"}),
+	"waiting_times": ("waiting_times.csv", {}),
+	"weather": ("weather_data.csv", {}),
+	"parade_night_show": ("parade_night_show.xlsx", {"index_col": 0}),
+	"entity_schedule": ("entity_schedule.csv", {}),
+	"attendance": ("attendance.csv", {}),
+}
+PIPELINE_STEPS = [
+	("clean", "clean_link_attraction_park", ["clean_link_attraction_park"], ["link_attraction_park"], ["link_attraction_park"]),
+	("clean", "clean_waiting_times", ["clean_waiting_times"], ["waiting_times"], ["waiting_times"]),
+	("clean", "clean_weather", ["clean_weather"], ["weather"], ["weather"]),
+	("clean", "clean_parade_night_show", ["clean_parade_night_show_attendance", "clean_parade_night_show"], ["parade_night_show_attendance", "parade_night_show"], ["parade_night_show"]),
+	("clean", "clean_entity_schedule", ["clean_entity_schedule"], ["entity_schedule", "entity_schedule_pivot"], ["entity_schedule"]),
+	("clean", "clean_attendance", ["clean_attendance"], ["attendance"], ["attendance"]),
+	("preprocess", "preprocess_weather", ["preprocess_weather"], ["weather"], []),
+	("preprocess", "preprocess_attendance", ["preprocess_attendance"], ["attendance"], []),
+	("preprocess", "preprocess_waiting_times", ["preprocess_waiting_times"], ["waiting_times"], []),
+	("preprocess", "preprocess_entity_schedule", ["preprocess_entity_schedule"], ["entity_schedule", "entity_schedule_pivot"], []),
+	("preprocess", "preprocess_parade_night_show", ["preprocess_parade_night_show", "preprocess_parade_night_show_attendance"], ["parade_night_show", "parade_night_show_attendance"], []),
+	("merge", "merge", ["merge"], ["merged", "merged_scaling"], []),
+]
+
+# Source files of the code that shapes the materialized pipeline steps and weather features:
+# this module, the columnar source cache (and its SOURCE_DTYPES), the step store and the weather store
+PIPELINE_MODULES = [
+	os.path.abspath(__file__),
+	*(os.path.abspath(sys.modules[cls.__module__].__file__) for cls in (TableCache, PipelineCache, WeatherFeatureStore)),
+]
+
+def _read_source_worker(attribute: str, path: str, read_kwargs: dict, cache_dir: str):
+	"""Read a source file in a worker process, through the columnar cache if `cache_dir` is set."""
+	start = time.perf_counter()
+	reader = pd.read_excel if path.endswith(".xlsx") else pd.read_csv
+	if cache_dir is None:
+		df = reader(path, **read_kwargs)
+	else:
+		df = TableCache(cache_dir).load(path, reader, **read_kwargs)
+	return attribute, df, time.perf_counter() - start
+
 
 class DataLoader:
 	"""A class to handle loading data files from a specified directory.
@@ -28,14 +77,16 @@ class DataLoader:
 		`weather` (`pd.DataFrame`): Weather data if `load_all_files=True`.
 		`waiting_times` (`pd.DataFrame`): Waiting times data if `load_all_files=True`.
 		`parade_night_show` (`pd.DataFrame`): Parade/show data if `load_all_files=True`.
+		`cache` (`TableCache`): Columnar snapshot cache of the source files, `None` if disabled.
 
 	Methods
 	-------
 		`load_file(file: str)` -> `pd.DataFrame`: Load a single file from the data directory.
 		`load_all_files()` -> `None`: Load all the files in the data directory.¨
 		`clean_data()` -> `None`: Clean the data.
+		`run_pipeline(until: str = "merge")` -> `None`: Clean, preprocess and merge the data, reusing materialized steps.
 	"""
-	def __init__(self, data_dir_path: str = "data", load_all_files: bool = False, clean_data: bool = False, db: bool = False):
+	def __init__(self, data_dir_path: str = "data", load_all_files: bool = False, clean_data: bool = False, db: bool = False, cache: bool = True, parallel_load: str = "threads"):
 		"""Initializes the DataLoader.
 
 	Args:
@@ -49,14 +100,19 @@ class DataLoader:
 			\n\t - `waiting_times`: Waiting times data.
 			\n\t - `parade_night_show`: Parade and night show data.
 			Defaults to False.
+		cache (bool, optional): Whether local files are served from typed Parquet snapshots
+			stored in `<data_dir_path>/.cache`. Defaults to True.
+		parallel_load (str, optional): How `load_all_files` loads the files: "threads", "processes"
+			or None for one after the other. Defaults to "threads".
 	"""
 		self.root_dir = self._find_git_root()
 		self.data_dir_path = os.path.join(self.root_dir, data_dir_path)
-		if load_all_files and not db:
-			self._load_all_files()
+		self.db = db
+		self.cache = TableCache(os.path.join(self.data_dir_path, ".cache")) if cache else None
+		if load_all_files:
+			self._load_all_files(parallel_load)
 		if clean_data:
 			self.clean_data()
-		self.db = db
 
 
 	def _find_git_root(self) -> str:
@@ -78,23 +134,98 @@ class DataLoader:
 				"Not a git repository. Please run from within the project repository."
 			)
 
-	def _load_all_files(self) -> pd.DataFrame:
+	def _load_all_files(self, parallel: str = "threads") -> None:
+		"""
+		Load all the files in the data directory (or in the bucket if `db=True`).
+
+		Args:
+			parallel: "threads" to load all the files concurrently (I/O bound, e.g. remote fetches),
+				"processes" to also parse them in worker processes (CPU bound, local files only),
+				or None to load them one after the other. Defaults to "threads".
+		"""
+		self._load_sources(list(PIPELINE_SOURCES), parallel)
+
+	def _load_sources(self, attributes: list, parallel: str = "threads") -> None:
 		"""
-		Load all the files in the data directory.
+		Load the source files of `attributes` (keys of `PIPELINE_SOURCES`) into these attributes.
+		The time spent on each file is stored in `self.load_timings`.
 		"""
-		self.attendance = pd.read_csv(os.path.join(self.data_dir_path, "attendance.csv"))
-		self.entity_schedule = pd.read_csv(os.path.join(self.data_dir_path, "entity_schedule.csv"))
-		self.link_attraction_park = pd.read_csv(os.path.join(self.data_dir_path, "link_attraction_park.csv"), sep=";")
-		self.weather = pd.read_csv(os.path.join(self.data_dir_path, "weather_data.csv"))
-		self.waiting_times = pd.read_csv(os.path.join(self.data_dir_path, "waiting_times.csv"))
-		self.parade_night_show = pd.read_excel(os.path.join(self.data_dir_path, "parade_night_show.xlsx"), index_col=0)
+		if parallel not in ("threads", "processes", None):
+			raise ValueError(f"Unknown parallel mode {parallel}, expected 'threads', 'processes' or None")
+		if parallel == "processes" and self.db:
+			parallel = "threads"
+		self.load_timings = getattr(self, 'load_timings', {})
+		start = time.perf_counter()
+
+		if parallel is None or len(attributes) <= 1:
+			results = [self._load_source(attribute) for attribute in attributes]
+		elif parallel == "threads":
+			with ThreadPoolExecutor(max_workers=len(attributes)) as pool:
+				results = list(pool.map(self._load_source, attributes))
+		else:
+			cache_dir = self.cache.cache_dir if self.cache is not None else None
+			with ProcessPoolExecutor(max_workers=min(len(attributes), os.cpu_count() or 1)) as pool:
+				futures = [
+					pool.submit(_read_source_worker, attribute, os.path.join(self.data_dir_path, PIPELINE_SOURCES[attribute][0]), PIPELINE_SOURCES[attribute][1], cache_dir)
+					for attribute in attributes
+				]
+				results = [future.result() for future in futures]
+
+		for attribute, df, seconds in results:
+			setattr(self, attribute, df)
+			self.load_timings[PIPELINE_SOURCES[attribute][0]] = seconds
+		self.load_timings['total'] = time.perf_counter() - start
+
+	def _load_source(self, attribute: str):
+		"""
+		Load the source file of an attribute, from the bucket for CSV files if `db=True`.
+		Returns the attribute, the loaded data and the time spent.
+		"""
+		file, read_kwargs = PIPELINE_SOURCES[attribute]
+		start = time.perf_counter()
+		if self.db and file.endswith(".csv"):
+			df = self.load_file_db(file)
+		else:
+			df = self._read_source(file, **read_kwargs)
+		return attribute, df, time.perf_counter() - start
+
+	def _read_source(self, file: str, columns: list = None, filters: list = None, **read_kwargs) -> pd.DataFrame:
+		"""Read a source file, through the columnar cache when it is enabled.
 
-	def load_file(self, file: str) -> pd.DataFrame:
+		Args
+		-------
+			`file` (`str`): The name of the file to read.
+			`columns` (`list`, optional): Columns to read, all by default.
+			`filters` (`list`, optional): Row predicates pushed down to the columnar snapshot, see `TableCache.load`.
+			`read_kwargs`: Extra arguments given to `pd.read_csv` or `pd.read_excel`.
+
+		Returns
+		-------
+			`pd.DataFrame`: The loaded data
+		"""
+		path = os.path.join(self.data_dir_path, file)
+		reader = pd.read_excel if file.endswith(".xlsx") else pd.read_csv
+		if self.cache is None:
+			if columns is not None:
+				read_kwargs['usecols'] = columns
+			return reader(path, **read_kwargs)
+		return self.cache.load(path, reader, columns=columns, filters=filters, **read_kwargs)
+
+	def load_file(self, file: str, columns: list = None, stream: bool = False, chunksize: int = 100_000, **filters) -> pd.DataFrame:
 		"""Load the data from the data directory.
 
+		Column projection and row predicates are applied during the read: against the columnar
+		snapshot when the cache is enabled, or chunk by chunk in stream mode.
+
 		Args
 		-------
 			`file` (`str`): The name of the file to load.
+			`columns` (`list`, optional): Columns to load, all by default. For files with one column per
+				attraction, the `attractions` filter also restricts the loaded columns.
+			`stream` (`bool`, optional): Parse CSV files by chunks of `chunksize` rows, filtering each
+				chunk before the next one is read. Defaults to False.
+			`chunksize` (`int`, optional): Number of rows per chunk in stream mode.
+			`filters`: Row predicates, see `filter_rows()`.
 
 		Returns
 		-------
@@ -104,48 +235,278 @@ class DataLoader:
 		-------
 			`ValueError`: If the file is not found in the data directory
 		"""
+		columns = self._projection(file, columns, filters.get('attractions'))
 		if self.db:
-			return self.load_file_db(file)
+			return self.load_file_db(file, columns=columns, stream=stream, chunksize=chunksize, **filters)
 		files = os.listdir(self.data_dir_path)
 		if file not in files:
 			raise ValueError(f"File {file} not found in {self.data_dir_path}")
-		if file.endswith(".csv"):
-			if file == "link_attraction_park.csv":
-				return pd.read_csv(os.path.join(self.data_dir_path, file), sep=";")
-			return pd.read_csv(os.path.join(self.data_dir_path, file))
-		elif file.endswith(".xlsx"):
-			return pd.read_excel(os.path.join(self.data_dir_path, file))
-
-	def load_file_db(self, file: str) -> pd.DataFrame:
-		load_dotenv(os.path.join(self.root_dir, '.secret'))
+		read_kwargs = {"sep": ";"} if file == "link_attraction_park.csv" else {}
+		if stream and file.endswith(".csv"):
+			return self._read_chunks(os.path.join(self.data_dir_path, file), file, chunksize, dict(read_kwargs, usecols=columns), filters)
+		if file.endswith(".csv") or file.endswith(".xlsx"):
+			df = self._read_source(file, columns=columns, filters=self._parquet_filters(file, **filters), **read_kwargs)
+			return self.filter_rows(df, file, **filters)
+
+	def load_file_db(self, file: str, columns: list = None, stream: bool = False, chunksize: int = 100_000, **filters) -> pd.DataFrame:
+		"""Load the data from the B2 bucket.
+
+		The object is mirrored in `<data_dir_path>/.cache/db` and only downloaded again when
+		its ETag changed; the process shares one pooled client per bucket.
+
+		Args
+		-------
+			`file` (`str`): The name of the file to load.
+			`columns` (`list`, optional): Columns to load, all by default.
+			`stream` (`bool`, optional): Feed the object body (or its up-to-date local copy) directly
+				to a chunked CSV reader, filtering each chunk of `chunksize` rows before the next one is
+				read, so that memory is bounded by the filtered result. Defaults to False.
+			`chunksize` (`int`, optional): Number of rows per chunk in stream mode.
+			`filters`: Row predicates, see `filter_rows()`.
+
+		Returns
+		-------
+			`pd.DataFrame`: The loaded data
+
+		Raises
+		-------
+			`ValueError`: If the file is not a data file, the environment variables are not set
+				or the file is not found in the bucket
+		"""
 		if not file.endswith(".csv"):
 			raise ValueError(f"File {file} is not a data file")
+		columns = self._projection(file, columns, filters.get('attractions'))
+		store = get_store(self.root_dir, os.path.join(self.data_dir_path, ".cache", "db"))
+		read_kwargs = {"sep": ";"} if file == "link_attraction_park.csv" else {}
+		if stream:
+			with store.open(file) as body:
+				return self._read_chunks(body, file, chunksize, dict(read_kwargs, usecols=columns), filters)
+		path = store.fetch(file)
+		if self.cache is None:
+			return self.filter_rows(pd.read_csv(path, usecols=columns, **read_kwargs), file, **filters)
+		df = self.cache.load(path, pd.read_csv, columns=columns, filters=self._parquet_filters(file, **filters), **read_kwargs)
+		return self.filter_rows(df, file, **filters)
+
+	def source_fingerprint(self, file: str, **read_kwargs) -> str:
+		"""Fingerprint of a source file, which changes whenever the file is updated.
+
+		In db mode the fingerprint is the one of the local mirror of the object, which is
+		first brought up to date with the bucket.
 
-		key_id = os.getenv('B2keyID')
-		db_name = os.getenv('B2DBNAME')
-		key_name = os.getenv('B2keyNAME')
-		key_app_key = os.getenv('B2keyAPPKEY')
-		endpoint = os.getenv('B2endpoint')
-		if not key_id or not db_name or not key_name or not key_app_key or not endpoint:
-			raise ValueError("Environment variables not set")
-		config = Config(signature_version='s3v4')
-		s3 = boto3.resource(service_name='s3',
-						  config=config,
-						  endpoint_url=endpoint,
-						  aws_access_key_id=key_id,
-						  aws_secret_access_key=key_app_key)
-		bucket = s3.Bucket(db_name)
-		if file not in [obj.key for obj in bucket.objects.all()]:
-			raise ValueError(f"File {file} not found in {db_name}")
-		obj = s3.Object(db_name, file)
-		csv_data = obj.get()['Body'].read().decode('utf-8')
-		if file == "link_attraction_park.csv":
-			return pd.read_csv(StringIO(csv_data), sep=";")
-		elif file == "parade_night_show.xlsx":
-			return pd.read_excel(os.path.join(self.data_dir_path, "parade_night_show.xlsx"), index_col=0)
+		Args
+		-------
+			`file` (`str`): The name of the file.
+			`read_kwargs`: Reader arguments, part of the fingerprint.
+
+		Returns
+		-------
+			`str`: A short hexadecimal digest, see `TableCache.fingerprint()`.
+		"""
+		if self.db:
+			path = get_store(self.root_dir, os.path.join(self.data_dir_path, ".cache", "db")).fetch(file)
 		else:
-			return pd.read_csv(StringIO(csv_data))
+			path = os.path.join(self.data_dir_path, file)
+		cache = self.cache or TableCache(os.path.join(self.data_dir_path, ".cache"))
+		return cache.fingerprint(path, **read_kwargs)
+
+	def _projection(self, file: str, columns: list = None, attractions: list = None) -> list:
+		"""
+		Columns to read from `file`: `columns`, restricted to the date, `Source` and `attractions` columns
+		for files with one column per attraction.
+		"""
+		if attractions is None or not SOURCE_DTYPES.get(file, {}).get("wide"):
+			return columns
+		if columns is None:
+			columns = [SOURCE_DTYPES[file]["date"], 'Source']
+		return list(columns) + [attraction for attraction in attractions if attraction not in columns]
+
+	def _parquet_filters(self, file: str, date_range=None, exclude_dates=None, park: str = None, attractions: list = None, source: int = None) -> list:
+		"""
+		Translate the row predicates of `filter_rows()` into the disjunctive normal form of pyarrow,
+		to push them down to the columnar snapshot of `file`. Returns None if there is nothing to push down.
+		"""
+		conjunction = []
+		date_col = SOURCE_DTYPES.get(file, {}).get("date")
+		if date_col is not None and date_range is not None:
+			start, end = date_range
+			if start is not None:
+				conjunction.append((date_col, '>=', pd.Timestamp(start)))
+			if end is not None:
+				conjunction.append((date_col, '<=', pd.Timestamp(end)))
+		long_format = not SOURCE_DTYPES.get(file, {}).get("wide") and file not in ('link_attraction_park.csv', 'attendance.csv', 'weather_data.csv')
+		if park is not None and long_format:
+			conjunction.append(('ENTITY_DESCRIPTION_SHORT', 'in', self.park_attractions(park) + [park]))
+		if park is not None and file == 'attendance.csv':
+			conjunction.append(('FACILITY_NAME', '==', park))
+		if attractions is not None and long_format:
+			conjunction.append(('ENTITY_DESCRIPTION_SHORT', 'in', list(attractions)))
+		if source is not None and SOURCE_DTYPES.get(file, {}).get("wide"):
+			conjunction.append(('Source', '==', source))
+		if date_col is not None and exclude_dates is not None:
+			start, end = exclude_dates
+			return [conjunction + [(date_col, '<', pd.Timestamp(start))], conjunction + [(date_col, '>', pd.Timestamp(end))]]
+		return [conjunction] if conjunction else None
+
+	def _read_chunks(self, source, file: str, chunksize: int, read_kwargs: dict, filters: dict) -> pd.DataFrame:
+		"""
+		Read a CSV file or stream by chunks, keeping only the rows matching `filters` in each chunk.
+		"""
+		chunks = [self.filter_rows(chunk, file, **filters) for chunk in pd.read_csv(source, chunksize=chunksize, **read_kwargs)]
+		df = pd.concat(chunks) if chunks else pd.DataFrame()
+		return df if self.cache is None else self.cache.apply_dtypes(df, file)
+
+	def filter_rows(self, df: pd.DataFrame, file: str, date_range=None, exclude_dates=None, park: str = None, attractions: list = None, source: int = None) -> pd.DataFrame:
+		"""Keep the rows of a table loaded from `file` that match the given predicates.
+
+		Args
+		-------
+			`df` (`pd.DataFrame`): The table.
+			`file` (`str`): The name of the file the table comes from, to find its date column.
+			`date_range` (`tuple`, optional): (start, end) dates, both included; either may be None.
+			`exclude_dates` (`tuple`, optional): (start, end) dates, both included, of rows to drop.
+			`park` (`str`, optional): Keep only the rows of this park (its attractions and the park itself).
+			`attractions` (`list`, optional): Keep only the rows of these attractions.
+			`source` (`int`, optional): Keep only the rows with this `Source` flag (0 for actual, 1 for predicted).
+
+		Returns
+		-------
+			`pd.DataFrame`: The filtered table
+		"""
+		mask = np.ones(len(df), dtype=bool)
+		date_col = SOURCE_DTYPES.get(file, {}).get("date")
+		if date_col in df.columns and (date_range is not None or exclude_dates is not None):
+			dates = pd.to_datetime(df[date_col], errors='coerce')
+			if date_range is not None:
+				start, end = date_range
+				if start is not None:
+					mask &= (dates >= pd.Timestamp(start)).to_numpy()
+				if end is not None:
+					mask &= (dates <= pd.Timestamp(end)).to_numpy()
+			if exclude_dates is not None:
+				start, end = exclude_dates
+				mask &= ~((dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))).to_numpy()
+		if park is not None:
+			if 'FACILITY_NAME' in df.columns:
+				mask &= (df['FACILITY_NAME'] == park).to_numpy()
+			elif 'ENTITY_DESCRIPTION_SHORT' in df.columns:
+				mask &= df['ENTITY_DESCRIPTION_SHORT'].isin(self.park_attractions(park) + [park]).to_numpy()
+		if attractions is not None and 'ENTITY_DESCRIPTION_SHORT' in df.columns:
+			mask &= df['ENTITY_DESCRIPTION_SHORT'].isin(attractions).to_numpy()
+		if source is not None and 'Source' in df.columns:
+			mask &= (df['Source'] == source).to_numpy()
+		return df if mask.all() else df[mask]
+
+	def park_attractions(self, park: str) -> list:
+		"""
+		List the attractions of a park, from link_attraction_park.csv.
+		"""
+		if not hasattr(self, '_link_attraction_park_raw'):
+			self._link_attraction_park_raw = self.load_file('link_attraction_park.csv')
+		link = self._link_attraction_park_raw
+		return link.loc[link['PARK'] == park, 'ATTRACTION'].tolist()
+
+	def waiting_times_pushdown(self) -> dict:
+		"""
+		Row filters of `clean_waiting_times()` that can be applied while loading a waiting times file:
+		the 2020-2021 exclusion and the PortAventura World park.
+		Loading with them makes the outlier bound of `clean_waiting_times()` computed on the park rows only.
+		"""
+		return {'exclude_dates': ('2020-01-01', '2021-12-31'), 'park': 'PortAventura World'}
+
+	def run_pipeline(self, until: str = "merge") -> None:
+		"""Run `clean_data()`, `data_preprocessing()` and `merge()`, reusing materialized steps.
+
+		Each step of `PIPELINE_STEPS` is keyed by the pipeline code version and the
+		fingerprints of the source files it depends on. Steps whose key is already
+		materialized are loaded from `<data_dir_path>/.cache/pipeline`, the others are
+		recomputed (after loading only the raw tables they need) and stored.
+
+		Args
+		-------
+			`until` (`str`, optional): Last stage to run, one of `"clean"`, `"preprocess"`
+				and `"merge"`. Defaults to `"merge"`.
+
+		Raises
+		-------
+			`ValueError`: If `until` is not a pipeline stage or the loader reads from the database
+		"""
+		stages = ["clean", "preprocess", "merge"]
+		if until not in stages:
+			raise ValueError(f"Unknown pipeline stage {until}, expected one of {stages}")
+		if self.db:
+			raise ValueError("The pipeline runs on local files only")
+		steps = [step for step in PIPELINE_STEPS if stages.index(step[0]) <= stages.index(until)]
+
+		if self.cache is None:
+			self._load_all_files()
+			for _, _, methods, _, _ in steps:
+				for method in methods:
+					getattr(self, method)()
+			return
+
+		pipeline_cache = PipelineCache(os.path.join(self.cache.cache_dir, "pipeline"), self._pipeline_code_version())
+
+		# an attribute depends on the sources of every step that produced it so far
+		source_fingerprints = {}
+		attribute_sources = {}
+		keys = []
+		for stage, name, methods, outputs, raw in steps:
+			sources = set()
+			for attribute in raw:
+				sources.add(attribute)
+			for attribute in self._step_inputs(name, outputs):
+				sources |= attribute_sources.get(attribute, set())
+			for attribute in sources:
+				if attribute not in source_fingerprints:
+					file, read_kwargs = PIPELINE_SOURCES[attribute]
+					source_fingerprints[attribute] = self.source_fingerprint(file, **read_kwargs)
+			for attribute in outputs:
+				attribute_sources[attribute] = set(sources)
+			extra = str(self._target_date()) if stage == "merge" else ""
+			keys.append(pipeline_cache.key(name, [f"{a}={source_fingerprints[a]}" for a in sorted(sources)], extra))
+
+		hits = [pipeline_cache.has(step[1], key, step[3]) for step, key in zip(steps, keys)]
+		# load every raw table needed by the recomputed steps at once
+		self._load_sources([attribute for step, hit in zip(steps, hits) if not hit for attribute in step[4]])
+		for i, ((stage, name, methods, outputs, raw), key) in enumerate(zip(steps, keys)):
+			if hits[i]:
+				# only load outputs that are still needed: final results, or inputs of a later recomputed step
+				needed = []
+				for attribute in outputs:
+					later = [j for j in range(i + 1, len(steps)) if attribute in steps[j][3]]
+					next_producer = later[0] if later else len(steps)
+					if not later or not all(hits[i + 1:next_producer + 1]):
+						needed.append(attribute)
+				for attribute, df in pipeline_cache.load(name, key, needed).items():
+					setattr(self, attribute, df)
+				continue
+			for method in methods:
+				getattr(self, method)()
+			pipeline_cache.save(name, key, {attribute: getattr(self, attribute) for attribute in outputs})
+
+	def _step_inputs(self, step: str, outputs: list) -> list:
+		"""
+		Attributes read by a pipeline step (besides the raw tables it loads).
+		"""
+		inputs = {
+			"clean_waiting_times": ["link_attraction_park"],
+			"clean_entity_schedule": ["link_attraction_park"],
+			"preprocess_waiting_times": ["link_attraction_park"],
+			"preprocess_entity_schedule": ["waiting_times"],
+			"merge": ["waiting_times", "parade_night_show", "parade_night_show_attendance", "entity_schedule_pivot", "entity_schedule", "weather", "attendance"],
+		}
+		return list(outputs) + inputs.get(step, [])
 
+	def _pipeline_code_version(self) -> str:
+		"""
+		Digest of the source code of this module and of the caches it materializes its steps with
+		(`PIPELINE_MODULES`), so that any change to the pipeline invalidates its materialized steps.
+		"""
+		digest = hashlib.sha1()
+		for path in PIPELINE_MODULES:
+			with open(path, "rb") as f:
+				digest.update(f.read())
+		return digest.hexdigest()[:16]
 
 	def clean_data(self):
 		"""
@@ -186,13 +547,14 @@ class DataLoader:
 		df["DEB_TIME"] = df["DEB_TIME"].astype("datetime64[s]")
 		df["FIN_TIME"] = df["FIN_TIME"].astype("datetime64[s]")
 
-		# Convert 'WORK_DATE' to datetime objects.
+		# Convert 'WORK_DATE' to datetime objects (already typed when loaded from the cache).
 		# Assuming 'WORK_DATE' is in DD/MM/YYYY format. Adjust format if necessary.
-		try:
-			df['WORK_DATE'] = pd.to_datetime(df['WORK_DATE'], format='%Y-%m-%d', errors='coerce')
-		except ValueError:
-			print("Error: Could not convert 'WORK_DATE' to datetime. Please check the date format in your 'WORK_DATE' column.")
-			return None
+		if not pd.api.types.is_datetime64_any_dtype(df['WORK_DATE']):
+			try:
+				df['WORK_DATE'] = pd.to_datetime(df['WORK_DATE'], format='%Y-%m-%d', errors='coerce')
+			except ValueError:
+				print("Error: Could not convert 'WORK_DATE' to datetime. Please check the date format in your 'WORK_DATE' column.")
+				return None
 
 		if df['WORK_DATE'].isnull().any():
 			print("Warning: Some 'WORK_DATE' values could not be converted to datetime and will be treated as NaT. Please check date formats.")
@@ -225,6 +587,8 @@ class DataLoader:
 		attractions = self.link_attraction_park['ATTRACTION'].tolist()
 		attractions.remove('Vertical Drop')
 		filtered_df = filtered_df[filtered_df['ENTITY_DESCRIPTION_SHORT'].isin(attractions + ['PortAventura World'])]
+		if isinstance(filtered_df['ENTITY_DESCRIPTION_SHORT'].dtype, pd.CategoricalDtype):
+			filtered_df['ENTITY_DESCRIPTION_SHORT'] = filtered_df['ENTITY_DESCRIPTION_SHORT'].cat.remove_unused_categories()
 
 		self.waiting_times = filtered_df
 
@@ -270,33 +634,32 @@ class DataLoader:
 		# drop all rows of non-existing parades and shows (nan values)
 		parade_night_show_ = parade_night_show_.dropna(subset=['show_or_parade'])
 
-		# create 15min granularity (to join with other tables) on separate dataframes
-		# Careful: here the behaviour with round and non-round times is not the same
-		parade_night_show_15 = parade_night_show_.copy()
-		parade_night_show_30 = parade_night_show_.copy()
-		# intermediary step: a parade is 30min, so depending on whether the minute of start is round or not, we need to create a 30min or a 45min time span 
-		round_times = [00, 15, 30, 45]
-		parade_night_show_30 = parade_night_show_30[parade_night_show_30['show_or_parade'].apply(lambda t: t.minute not in round_times)]
-		# adding 15 and 30 min deltas
-		time_change_15 = timedelta(minutes=15)
-		time_change_30 = timedelta(minutes=30)
-
-		parade_night_show_15['show_or_parade'] = parade_night_show_15['show_or_parade'].apply(
-			lambda t: (datetime.combine(datetime.today(), t) + time_change_15).time()
-		)
-
-		parade_night_show_30['show_or_parade'] = parade_night_show_30['show_or_parade'].apply(
-			lambda t: (datetime.combine(datetime.today(), t) + time_change_30).time()
-		)
-
-		# concat all the granular df into one
-		parade_night_show_ = pd.concat([parade_night_show_, parade_night_show_15, parade_night_show_30])
-
-		# to merge this with waiting times, we need full datetimes (date + hour)
-		parade_night_show_['show_or_parade'] = parade_night_show_.apply(lambda row: pd.to_datetime(f"{row['WORK_DATE'].date()} {row['show_or_parade']}"), axis=1).astype('datetime64[s]')
+		# time of day of each show as a timedelta, so every step below works on whole columns
+		time_of_day = pd.to_timedelta(parade_night_show_['show_or_parade'].astype(str))
+		one_day = pd.Timedelta(days=1)
+		quarter = pd.Timedelta(minutes=15)
 
-		# round down the minutes (to match with DEB_TIME in waiting times table)
-		parade_night_show_['show_or_parade'] = parade_night_show_['show_or_parade'].apply(lambda dt: self.round_to_quarter(dt, down=True))
+		# create 15min granularity (to join with other tables)
+		# Careful: here the behaviour with round and non-round times is not the same
+		# intermediary step: a parade is 30min, so depending on whether the minute of start is round or not, we need to create a 30min or a 45min time span
+		not_round = ((time_of_day // pd.Timedelta(minutes=1)) % 15 != 0).to_numpy()
+		time_of_day = pd.concat([
+			time_of_day,
+			(time_of_day + quarter) % one_day,
+			(time_of_day[not_round] + 2 * quarter) % one_day,
+		])
+		parade_night_show_ = pd.concat([parade_night_show_, parade_night_show_, parade_night_show_[not_round]])
+
+		# to merge this with waiting times, we need full datetimes (date + hour), truncated to the second
+		time_of_day = time_of_day.dt.floor('s')
+
+		# round down the minutes (to match with DEB_TIME in waiting times table), never below 00:15
+		minutes = time_of_day // pd.Timedelta(minutes=1)
+		seconds = time_of_day - minutes * pd.Timedelta(minutes=1)
+		rounded_minutes = ((minutes // 15) * 15).clip(lower=15)
+		parade_night_show_['show_or_parade'] = (
+			parade_night_show_['WORK_DATE'].dt.normalize().to_numpy() + (rounded_minutes * pd.Timedelta(minutes=1) + seconds).to_numpy()
+		).astype('datetime64[ns]')
 
 		parade_night_show_['WORK_DATE'] = parade_night_show_['WORK_DATE'].astype('datetime64[s]')
 
@@ -309,6 +672,9 @@ class DataLoader:
 		attractions = self.link_attraction_park['ATTRACTION'].tolist()
 		attractions.remove('Vertical Drop')
 		self.entity_schedule = self.entity_schedule[self.entity_schedule['ENTITY_DESCRIPTION_SHORT'].isin(attractions)] # + ['PortAventura World']
+		if isinstance(self.entity_schedule['ENTITY_DESCRIPTION_SHORT'].dtype, pd.CategoricalDtype):
+			# keep attraction names as plain labels in the pivot columns
+			self.entity_schedule['ENTITY_DESCRIPTION_SHORT'] = self.entity_schedule['ENTITY_DESCRIPTION_SHORT'].astype(str)
 
 		self.entity_schedule = self.entity_schedule[(self.entity_schedule['WORK_DATE'] < '2020-01-01') | (self.entity_schedule['WORK_DATE'] >= '2022-01-01')]
 
@@ -400,15 +766,79 @@ class DataLoader:
 
 		self.weather.loc[self.weather['dt_iso'].dt.year.isin([2018, 2019]), 'dt_iso'] += pd.DateOffset(years=2)
 
-		self.weather['minute'] = self.weather['dt_iso'].dt.minute
-		self.weather['hour'] = self.weather['dt_iso'].dt.hour
-		self.weather['day'] = self.weather['dt_iso'].dt.day
-		self.weather['month'] = self.weather['dt_iso'].dt.month
-		self.weather['day_of_week'] = self.weather['dt_iso'].dt.dayofweek
-		self.weather['is_weekend'] = self.weather['dt_iso'].dt.dayofweek.isin([5, 6]).astype(int)
-		self.weather['is_peak_hour'] = self.weather['hour'].between(11, 18).astype(int)
+		for column, values in self.calendar_features(self.weather['dt_iso']).items():
+			self.weather[column] = values
+
+	@staticmethod
+	def calendar_features(times) -> pd.DataFrame:
+		"""Calendar features of timestamps, the ones `preprocess_weather()` adds to the hourly weather.
 
+		Args
+		-------
+			`times` (`pd.Series` or `pd.DatetimeIndex`): The timestamps.
 
+		Returns
+		-------
+			`pd.DataFrame`: One row per timestamp, with the index of `times` if it is a Series.
+		"""
+		times = pd.Series(times)
+		return pd.DataFrame({
+			'minute': times.dt.minute,
+			'hour': times.dt.hour,
+			'day': times.dt.day,
+			'month': times.dt.month,
+			'day_of_week': times.dt.dayofweek,
+			'is_weekend': times.dt.dayofweek.isin([5, 6]).astype(int),
+			'is_peak_hour': times.dt.hour.between(11, 18).astype(int),
+		})
+
+
+
+	def weather_store(self) -> WeatherFeatureStore:
+		"""Hourly weather feature store, shared by the wait time and attendance pipelines.
+
+		When the `weather` attribute holds the preprocessed weather (after `preprocess_weather()`), the
+		store is built from it, once per content of the table, so that edits to it are taken into account.
+		Otherwise the store is built from `weather_data.csv` with `clean_weather()` and `preprocess_weather()`,
+		once per version of the file and of this module, and persisted in `<data_dir_path>/.cache`.
+		The `weather` attribute is left untouched.
+
+		Returns
+		-------
+			`WeatherFeatureStore`: The store.
+		"""
+		weather = self.__dict__.get("weather")
+		if weather is not None and "weather_main_encoded" in weather:
+			key = hashlib.sha1(pd.util.hash_pandas_object(weather).to_numpy().tobytes() + str(list(weather.columns)).encode()).hexdigest()[:16]
+			if getattr(self, "_weather_store", (None, None))[0] != key:
+				self._weather_store = (key, WeatherFeatureStore(weather))
+			return self._weather_store[1]
+
+		file, read_kwargs = PIPELINE_SOURCES["weather"]
+		key = hashlib.sha1(f"{self._pipeline_code_version()}:{self.source_fingerprint(file, **read_kwargs)}".encode()).hexdigest()[:16]
+		if getattr(self, "_weather_store", (None, None))[0] == key:
+			return self._weather_store[1]
+		path = os.path.join(self.data_dir_path, ".cache", f"weather_features.{key}.arrow")
+		if self.cache is not None and os.path.exists(path):
+			store = WeatherFeatureStore.load(path)
+		else:
+			weather = self.__dict__.pop("weather", None)
+			try:
+				self.weather = self._load_source("weather")[1]
+				self.clean_weather()
+				self.preprocess_weather()
+				store = WeatherFeatureStore(self.weather)
+			finally:
+				self.__dict__.pop("weather", None)
+				if weather is not None:
+					self.weather = weather
+			if self.cache is not None:
+				for old in os.listdir(os.path.dirname(path)):
+					if old.startswith("weather_features.") and old.endswith(".arrow"):
+						os.remove(os.path.join(os.path.dirname(path), old))
+				store.save(path)
+		self._weather_store = (key, store)
+		return store
 
 	def preprocess_parade_night_show(self):
 		"""
@@ -426,10 +856,13 @@ class DataLoader:
 		"""
 		self.parade_night_show_attendance.loc[self.parade_night_show_attendance['WORK_DATE'].dt.year.isin([2018, 2019]), 'WORK_DATE'] += pd.DateOffset(years=2)
 
-	def preprocess_entity_schedule(self):
+	def preprocess_entity_schedule(self, schedule_gaps=(("2022-01-01", "2022-03-31"),)):
 		"""
 		Preprocess the data.
 
+		Args:
+			schedule_gaps: (start, end) date pairs, both included, for which the schedule is missing
+				and is inferred from the waiting times. Defaults to the first quarter of 2022.
 		"""
 		# currently we have dropped those columns
 		"""self.entity_schedule.loc[self.entity_schedule['DEB_TIME'].dt.year.isin([2018, 2019]), 'DEB_TIME'] += pd.DateOffset(years=2)
@@ -439,12 +872,32 @@ class DataLoader:
 		self.entity_schedule_pivot.loc[self.entity_schedule_pivot['WORK_DATE'].dt.year.isin([2018, 2019]), 'WORK_DATE'] += pd.DateOffset(years=2)
 		self.entity_schedule_pivot = self.entity_schedule_pivot.set_index('WORK_DATE')
 
-		# Define start and end dates
-		start_date = np.datetime64('2022-01-01')
-		end_date = np.datetime64('2022-03-31')
+		missing_schedules = [self.infer_missing_schedule(start, end) for start, end in schedule_gaps]
 
+		# concatenate it with existing entity_schedule_pivot
+		self.entity_schedule_pivot = pd.concat([self.entity_schedule_pivot] + missing_schedules).sort_values('WORK_DATE')
+
+		# melt the pivoted missing schedule to match entity_schedule table
+		df_melt = [
+			pd.melt(df_missing_schedule.reset_index(), id_vars='WORK_DATE', var_name='ENTITY_DESCRIPTION_SHORT', value_name='IS_OPEN')
+			for df_missing_schedule in missing_schedules
+		]
+		self.entity_schedule = pd.concat([self.entity_schedule] + df_melt)
+
+	def infer_missing_schedule(self, start: str, end: str) -> pd.DataFrame:
+		"""
+		Infer the schedule of the attractions between two dates (both included) from the waiting times:
+		an attraction was open on a day if at least one of its rows that day has a non-zero OPEN_TIME.
+
+		Args:
+			start: First date of the gap, e.g. '2022-01-01'.
+			end: Last date of the gap, e.g. '2022-03-31'.
+		Returns:
+			pandas DataFrame indexed by WORK_DATE with one column per attraction of entity_schedule_pivot,
+			1 if the attraction was open that day and the known schedule (or 0) otherwise.
+		"""
 		# Generate an array of dates
-		date_range = np.arange(start_date, end_date + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+		date_range = np.arange(np.datetime64(start), np.datetime64(end) + np.timedelta64(1, 'D'), dtype='datetime64[D]')
 		date_range_seconds = date_range.astype('datetime64[s]')
 
 		# create empty entity_schedule_pivot with only the missing dates
@@ -452,22 +905,15 @@ class DataLoader:
 		df_missing_schedule = df_missing_schedule.merge(self.entity_schedule_pivot, on='WORK_DATE', how='left').fillna(0)
 
 		# retrieve only the useful rows from self.waiting_times
-		waiting_times = self.waiting_times[(self.waiting_times['WORK_DATE'] >= '2022-01-01') & (self.waiting_times['WORK_DATE'] <= '2022-03-31')]
-		waiting_times.shape
-
-		# iterate on waiting times, and if an attraction was used at least once on that day, mark the attraction as open for that day
-		for index, row in waiting_times.iterrows():
-			if row['ENTITY_DESCRIPTION_SHORT'] in list(df_missing_schedule.columns):
-				if row['OPEN_TIME'] != 0:
-					df_missing_schedule.loc[row['WORK_DATE'], row['ENTITY_DESCRIPTION_SHORT']] = 1
-
-		# concatenate it with existing entity_schedule_pivot
-		self.entity_schedule_pivot = pd.concat([self.entity_schedule_pivot, df_missing_schedule]).sort_values('WORK_DATE')
+		waiting_times = self.waiting_times[(self.waiting_times['WORK_DATE'] >= start) & (self.waiting_times['WORK_DATE'] <= end)]
+		waiting_times = waiting_times[
+			waiting_times['ENTITY_DESCRIPTION_SHORT'].isin(df_missing_schedule.columns) & (waiting_times['OPEN_TIME'] != 0)
+		]
 
-		# melt the pivoted missing schedule to match entity_schedule table
-		df_missing_schedule_ = df_missing_schedule.copy().reset_index()
-		df_melt = pd.melt(df_missing_schedule_, id_vars='WORK_DATE', var_name='ENTITY_DESCRIPTION_SHORT', value_name='IS_OPEN')
-		self.entity_schedule = pd.concat([self.entity_schedule, df_melt])
+		# if an attraction was used at least once on that day, mark the attraction as open for that day
+		used = waiting_times.groupby(['WORK_DATE', 'ENTITY_DESCRIPTION_SHORT'], observed=True).size() > 0
+		used = used.unstack(fill_value=False).reindex(index=df_missing_schedule.index, columns=df_missing_schedule.columns, fill_value=False)
+		return df_missing_schedule.mask(used.astype(bool), 1)
 
 	def preprocess_link_attraction_park(self):
 		"""
@@ -483,19 +929,109 @@ class DataLoader:
 		# Add 2 years to rows with year 2018 and 2019
 		self.attendance.loc[self.attendance['USAGE_DATE'].dt.year.isin([2018, 2019]), 'USAGE_DATE'] += pd.DateOffset(years=2)
 
-	def merge(self):
+	def merge(self, single_pass: bool = True, profile: bool = False):
 		"""
 			Merge all tables for model.
+
+			Args:
+				single_pass: Build the table with `merge_single_pass()` (one sort, keyed lookups,
+					back-fill scoped per attraction). If False, chain the former per-table merges,
+					which sort and back-fill the whole frame after each join.
+				profile: Measure wall-clock time and peak memory of the merge, stored in
+					`self.merge_profile` and printed.
 		"""
-		self.merge_parade_night_show()
-		self.merge_parade_night_show_attendance()
-		self.merge_entity_schedule_pivot()
-		self.merge_entity_schedule()
-		self.merge_weather()
-		self.merge_attendance()
+		if profile:
+			tracemalloc.start()
+			start = time.perf_counter()
+		if single_pass:
+			self.merge_single_pass()
+		else:
+			self.merge_parade_night_show()
+			self.merge_parade_night_show_attendance()
+			self.merge_entity_schedule_pivot()
+			self.merge_entity_schedule()
+			self.merge_weather()
+			self.merge_attendance()
 		self.scale_and_move_to_2025()
-		
-		
+		if profile:
+			_, peak = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+			self.merge_profile = {'seconds': time.perf_counter() - start, 'peak_memory_mb': peak / 2**20}
+			print(f"merge ({'single pass' if single_pass else 'chained'}): {self.merge_profile['seconds']:.2f}s, peak memory {self.merge_profile['peak_memory_mb']:.1f} MB")
+
+	def merge_single_pass(self):
+		"""
+			Build the waiting time feature table in one planned pass.
+			Every dimension table is indexed once by its join key and looked up for all rows of waiting_times,
+			the rows are sorted by DEB_TIME like in the chained merge, and missing values are back-filled within
+			each attraction (IS_OPEN of the park rows from the next row, as in the chained merge), so that the
+			table is the same as with the chained merges. Dimension tables with duplicated keys contribute their first row.
+			The hourly weather is looked up in the persisted `weather_store()`.
+		"""
+		# same (unstable) sorts as the chained merge, so that rows with the same DEB_TIME come in the same order
+		waiting_times = self.waiting_times.sort_values('DEB_TIME').sort_values('DEB_TIME').reset_index(drop=True)
+		work_date = waiting_times['WORK_DATE']
+
+		# parades and shows: flag the quarters during which a show is running
+		show_times = self.parade_night_show['show_or_parade'].astype('datetime64[ns]')
+		show_or_parade = waiting_times['DEB_TIME'].astype('datetime64[ns]').isin(show_times).astype(int).rename('show_or_parade')
+
+		# number of parades per day, no parade when the day is unknown
+		num_parade = self._lookup([work_date], self.parade_night_show_attendance.set_index('WORK_DATE')[['Num_parade']]).fillna(0)
+
+		# daily schedule of every attraction, and of the attraction of the row
+		schedule = self._lookup([work_date], self.entity_schedule_pivot)
+		is_open = self._lookup(
+			[work_date, waiting_times['ENTITY_DESCRIPTION_SHORT']],
+			self.entity_schedule.set_index(['WORK_DATE', 'ENTITY_DESCRIPTION_SHORT'])[['IS_OPEN']]
+		)
+
+		# hourly weather
+		weather_time = pd.to_datetime(work_date) + pd.to_timedelta(waiting_times['DEB_TIME_HOUR'], unit='h')
+		weather = self.weather_store().lookup(weather_time)
+
+		# daily attendance
+		attendance = self._lookup([work_date], self.attendance.set_index('USAGE_DATE'))
+
+		merged = pd.concat([waiting_times, show_or_parade, num_parade, schedule, is_open, weather, attendance], axis=1)
+		attendance_columns = attendance.columns
+		del waiting_times, work_date, weather_time, show_or_parade, num_parade, schedule, is_open, weather, attendance
+
+		# back-fill missing values from the next quarters of the same attraction (attendance is left as is)
+		missing = [col for col in merged.columns[merged.isna().any()] if col not in list(attendance_columns) + ['IS_OPEN']]
+		if missing:
+			merged[missing] = merged.groupby('ENTITY_DESCRIPTION_SHORT', sort=False, observed=True)[missing].bfill()
+		# the park rows have no schedule: like in the chained merge, they take IS_OPEN from the next row, whatever its attraction
+		merged['IS_OPEN'] = merged['IS_OPEN'].bfill()
+		# the chained merge sorts once more before merging the weather; this also consolidates the column blocks
+		self.merged = merged.sort_values('DEB_TIME').reset_index(drop=True)
+
+	def _lookup(self, keys: list, table: pd.DataFrame) -> pd.DataFrame:
+		"""
+			Left join of `table` on `keys` (one Series per level of the index of `table`).
+			Rows without a match are NaN and the result is aligned with `keys`.
+		"""
+		def as_key(values):
+			values = pd.Series(values)
+			if pd.api.types.is_datetime64_any_dtype(values):
+				return values.astype('datetime64[ns]').to_numpy()
+			return values.astype(object).to_numpy()
+
+		index = table.index
+		if isinstance(index, pd.MultiIndex):
+			index = pd.MultiIndex.from_arrays([as_key(index.get_level_values(i)) for i in range(index.nlevels)])
+			key_index = pd.MultiIndex.from_arrays([as_key(key) for key in keys])
+		else:
+			index = pd.Index(as_key(index))
+			key_index = pd.Index(as_key(keys[0]))
+		table = table.copy(deep=False)
+		table.index = index
+		if not index.is_unique:
+			table = table[~index.duplicated()]
+		result = table.reindex(key_index)
+		result.index = pd.RangeIndex(len(result))
+		return result
+
 	def merge_parade_night_show(self):
 		"""
 			merge waiting_times with parade_night_show
@@ -548,6 +1084,9 @@ class DataLoader:
 	def scale_and_move_to_2025(self):
 		"""
 		Scale the data (only for rows up to 2021-12-23) and then move it so that the last date aligns with 'today' (if after noon) or 'yesterday' (if before noon).
+
+		The fitted scaling and the shift are kept in `merged_scaling`: the `min` and `scale` of every
+		scaled column (see `scale_merged()`), and the number of days the dates were moved by (`days_shifted`).
 		"""
 
 		# Filter data up to 2021-12-23
@@ -563,15 +1102,15 @@ class DataLoader:
 		]
 
 		# Scale numerical columns with MinMaxScaler
-		scaler = MinMaxScaler()
-		self.merged[numerical_columns] = scaler.fit_transform(self.merged[numerical_columns])
+		scaler = MinMaxScaler().fit(self.merged[numerical_columns])
+		self.merged_scaling = pd.DataFrame({'min': scaler.min_, 'scale': scaler.scale_}, index=numerical_columns)
+		self.scale_merged(self.merged, self.merged_scaling)
 
 		# Get the maximum date in the filtered dataset
 		max_date = self.merged["WORK_DATE"].max()
 
 		# Determine target date (today if after noon, yesterday if before noon)
-		now = datetime.now()
-		target_date = datetime.today().date() if now.hour >= 12 else (datetime.today() - timedelta(days=1)).date()
+		target_date = self._target_date()
 
 		# Compute the shift needed
 		days_to_shift = (pd.Timestamp(target_date) - max_date).days
@@ -582,6 +1121,32 @@ class DataLoader:
 
 		self.merged["DEB_TIME"] = self.merged["DEB_TIME"] + pd.Timedelta(days=days_to_shift)
 		self.merged["FIN_TIME"] = self.merged["FIN_TIME"] + pd.Timedelta(days=days_to_shift)
+		self.merged_scaling["days_shifted"] = days_to_shift
+
+	@staticmethod
+	def scale_merged(df: pd.DataFrame, scaling: pd.DataFrame) -> pd.DataFrame:
+		"""Scale the columns of `df` like `scale_and_move_to_2025()` scaled the merged data.
+
+		Args
+		-------
+			`df` (`pd.DataFrame`): Unscaled data, only its columns listed in `scaling` are scaled (in place).
+			`scaling` (`pd.DataFrame`): `merged_scaling` of the loader that built the merged data.
+
+		Returns
+		-------
+			`pd.DataFrame`: `df`
+		"""
+		columns = [column for column in scaling.index if column in df]
+		# same operations as MinMaxScaler.transform
+		df[columns] = df[columns] * scaling.loc[columns, 'scale'].to_numpy() + scaling.loc[columns, 'min'].to_numpy()
+		return df
+
+	def _target_date(self):
+		"""
+		Date the merged data is aligned on: today if after noon, yesterday if before noon.
+		"""
+		now = datetime.now()
+		return datetime.today().date() if now.hour >= 12 else (datetime.today() - timedelta(days=1)).date()
 
 	def round_to_quarter(self, dt, down=True):
 		"""
@@ -602,8 +1167,6 @@ class DataLoader:
 	def data_preprocessing_attendance_pred(self):
 		"""
 		Preprocess the data for the attedance prediction model.
+		The noon weather of every day is taken from the persisted `weather_store()`.
 		"""
-		self.weather.drop(columns=['hour'], inplace=True)
-		self.weather = self.weather[self.weather['dt_iso'].dt.hour == 12].copy()
-		self.weather['dt_iso'] = self.weather['dt_iso'].dt.date
-		pass
+		self.weather = self.weather_store().daily(hour=12)
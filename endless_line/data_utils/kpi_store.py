@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch:
+	"""A mergeable quantile sketch of waiting times.
+
+	Values are rounded to a multiple of `resolution` and counted, so the sketch holds
+	one counter per distinct rounded value (a few hundred at most for waiting times in
+	minutes). Sketches of several attractions are merged by adding their counters, and
+	new values are added incrementally with `update()`.
+
+	Error bound: the rank of every value is exact, and every value is off by at most
+	`resolution / 2`, so quantiles and thresholds are within `resolution / 2` of the exact
+	ones. Waiting times are whole minutes, so the default resolution of 1 is exact.
+
+	Attributes
+	----------
+		`resolution` (`float`): Width of the rounding step.
+		`counts` (`pd.Series`): Number of values, by rounded value divided by `resolution`.
+
+	Methods
+	-------
+		`update(values)` -> `None`: Add values to the sketch.
+		`merge(sketches: list)` -> `QuantileSketch`: Merge several sketches into a new one.
+		`quantile(q: float)` -> `float`: Quantile, with the linear interpolation of `pd.Series.quantile`.
+		`count_above(threshold: float)` -> `int`: Number of values strictly above a threshold.
+	"""
+	def __init__(self, resolution: float = 1.0):
+		self.resolution = resolution
+		self.counts = pd.Series(dtype="int64")
+
+	def update(self, values) -> None:
+		"""Add values to the sketch, missing values are ignored."""
+		values = np.asarray(values, dtype=float)
+		steps, counts = np.unique(np.round(values[~np.isnan(values)] / self.resolution).astype("int64"), return_counts=True)
+		self.counts = self.counts.add(pd.Series(counts, index=steps), fill_value=0).astype("int64").sort_index()
+
+	@classmethod
+	def merge(cls, sketches: list, resolution: float = 1.0) -> "QuantileSketch":
+		"""Merge sketches of the same resolution into a new sketch."""
+		merged = cls(sketches[0].resolution if sketches else resolution)
+		if sketches:
+			merged.counts = pd.concat([sketch.counts for sketch in sketches]).groupby(level=0).sum().astype("int64")
+		return merged
+
+	def quantile(self, q: float) -> float:
+		"""Quantile of the values, NaN if the sketch is empty."""
+		cumulative = self.counts.to_numpy().cumsum()
+		if not len(cumulative):
+			return np.nan
+		values = self.counts.index.to_numpy(dtype=float) * self.resolution
+		position = q * (cumulative[-1] - 1)
+		lower = values[np.searchsorted(cumulative, np.floor(position), side='right')]
+		upper = values[np.searchsorted(cumulative, np.ceil(position), side='right')]
+		return lower + (upper - lower) * (position - np.floor(position))
+
+	def count_above(self, threshold: float) -> int:
+		"""Number of values strictly above `threshold`, 0 if the threshold is NaN."""
+		return int(self.counts[self.counts.index.to_numpy(dtype=float) * self.resolution > threshold].sum())
+
+
+def wtei_partials(predicted: pd.DataFrame, attractions: list = None, start=None, end=None):
+	"""Sums and counts of the non-zero actual / predicted waiting time ratios of every attraction.
+
+	The actual (`Source` 0) and predicted (`Source` 1) rows are aligned on `DEB_TIME` as two
+	(time x attraction) matrices, and the ratios of all attractions are reduced at once.
+	Actual times without a prediction give a missing ratio; if a time is predicted more than
+	once, its first prediction is used.
+
+	Args
+	-------
+		`predicted` (`pd.DataFrame`): LSTM waiting times, one column per attraction, with `DEB_TIME` and `Source`.
+		`attractions` (`list`, optional): Attractions to consider, every attraction column by default.
+		`start`, `end` (optional): Bounds of the `DEB_TIME` window, both included; either may be None.
+
+	Returns
+	-------
+		`tuple`: `pd.Series` of the sums of the ratios and `pd.Series` of their counts, by attraction
+	"""
+	if attractions is None:
+		attractions = [col for col in predicted.columns if col not in ('DEB_TIME', 'Source')]
+	times = pd.to_datetime(predicted['DEB_TIME']).to_numpy()
+	window = np.ones(len(times), dtype=bool)
+	if start is not None:
+		window &= times >= pd.Timestamp(start).to_datetime64()
+	if end is not None:
+		window &= times <= pd.Timestamp(end).to_datetime64()
+	source = predicted['Source'].to_numpy()
+	values = predicted[attractions].to_numpy(dtype=float)
+	actual = window & (source == 0)
+	forecast = window & (source == 1)
+
+	forecast_times, first = np.unique(times[forecast], return_index=True)
+	position = np.minimum(np.searchsorted(forecast_times, times[actual]), max(len(forecast_times) - 1, 0))
+	matched = forecast_times[position] == times[actual] if len(forecast_times) else np.zeros(actual.sum(), dtype=bool)
+	forecast_values = np.full((actual.sum(), len(attractions)), np.nan)
+	forecast_values[matched] = values[forecast][first][position[matched]]
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		ratios = values[actual] / forecast_values
+	valid = ~np.isnan(ratios) & (ratios != 0)
+	sums = np.where(valid, ratios, 0).sum(axis=0)
+	return pd.Series(sums, index=attractions), pd.Series(valid.sum(axis=0), index=attractions)
+
+
+def wtei_ratios(predicted: pd.DataFrame, attractions: list = None, start=None, end=None) -> pd.Series:
+	"""Mean of the non-zero actual / predicted waiting time ratios of every attraction, see `wtei_partials()`.
+
+	Returns
+	-------
+		`pd.Series`: The mean ratios by attraction, NaN for attractions without any ratio
+	"""
+	sums, counts = wtei_partials(predicted, attractions, start, end)
+	return sums / counts.where(counts > 0)
+
+
+class KpiStore:
+	"""Per-attraction partial aggregates of the dashboard KPIs.
+
+	The waiting times and LSTM predictions are scanned once, when the store is built;
+	the KPIs of any selection of attractions are then answered by combining the
+	partials of the selected attractions, without touching the rows again. New
+	waiting times rows are added incrementally with `update()`.
+
+	Attributes
+	----------
+		`rows` (`pd.Series`): Number of waiting times rows, by attraction.
+		`sketches` (`dict`): `QuantileSketch` of `WAIT_TIME_MAX`, by attraction.
+		`daily` (`pd.DataFrame`): Sum (`sum`) and number of non-missing values (`count`) of `WAIT_TIME_MAX`,
+			indexed by attraction and `WORK_DATE`.
+		`ratio_sums` (`pd.Series`): Sum of the non-zero actual / predicted waiting time ratios, by attraction.
+		`ratio_counts` (`pd.Series`): Number of non-zero actual / predicted waiting time ratios, by attraction.
+
+	Methods
+	-------
+		`update(waiting_times: pd.DataFrame)` -> `None`: Add cleaned waiting times rows to the partials.
+		`kpi1(attractions: list)` -> `str`: Percentage of time the waiting time was above its 80th percentile.
+		`kpi2(attractions: list)` -> `dict`: Mean actual / predicted waiting time ratio of each attraction.
+		`kpi3(attractions: list, max_date=None)` -> `float`: Average waiting time of the past month.
+	"""
+	def __init__(self, waiting_times: pd.DataFrame, predicted: pd.DataFrame, resolution: float = 1.0):
+		"""
+		Args
+		-------
+			`waiting_times` (`pd.DataFrame`): Cleaned waiting times, see `DataLoader.clean_waiting_times()`.
+			`predicted` (`pd.DataFrame`): LSTM waiting times, one column per attraction, with `DEB_TIME` and `Source`.
+			`resolution` (`float`, optional): Resolution of the waiting time sketches, in minutes.
+		"""
+		self.resolution = resolution
+		self.rows = pd.Series(dtype="int64")
+		self.sketches = {}
+		self.daily = None
+		self.update(waiting_times)
+
+		self.ratio_sums, self.ratio_counts = wtei_partials(predicted)
+
+	def update(self, waiting_times: pd.DataFrame) -> None:
+		"""Add waiting times rows, cleaned like those the store was built from, to the partials.
+
+		Args
+		-------
+			`waiting_times` (`pd.DataFrame`): New rows, e.g. the latest 15-minute records.
+		"""
+		attraction = waiting_times['ENTITY_DESCRIPTION_SHORT'].astype(str)
+		wait = waiting_times['WAIT_TIME_MAX']
+		self.rows = self.rows.add(attraction.value_counts(), fill_value=0).astype("int64")
+		for name, values in wait.groupby(attraction):
+			self.sketches.setdefault(name, QuantileSketch(self.resolution)).update(values)
+
+		daily = wait.groupby([attraction, pd.to_datetime(waiting_times['WORK_DATE'])]).agg(['sum', 'count'])
+		self.daily = daily if self.daily is None else pd.concat([self.daily, daily]).groupby(level=[0, 1]).sum()
+
+	def kpi1(self, attractions: list) -> str:
+		"""
+		Args
+		-------
+			`attractions` (`list`): Attractions to consider.
+
+		Returns
+		-------
+			`str`: Percentage of time the waiting time was above both its 80th percentile and 30 minutes
+		"""
+		attractions = list(dict.fromkeys(attractions))
+		sketch = QuantileSketch.merge([self.sketches[name] for name in attractions if name in self.sketches], self.resolution)
+		wait_time_80 = sketch.quantile(0.8)
+		count_sup_80 = sketch.count_above(max(wait_time_80, 30)) if not np.isnan(wait_time_80) else 0
+		rows = self.rows.reindex(attractions, fill_value=0).sum()
+		return str(round(count_sup_80 / rows * 100, 2) if rows else np.nan) + '%'
+
+	def kpi2(self, attractions: list) -> dict:
+		"""
+		Args
+		-------
+			`attractions` (`list`): Attractions to consider.
+
+		Returns
+		-------
+			`dict`: Mean of the non-zero actual / predicted waiting time ratios, by attraction
+		"""
+		return (self.ratio_sums.reindex(attractions) / self.ratio_counts.reindex(attractions)).to_dict()
+
+	def kpi3(self, attractions: list, max_date=None) -> float:
+		"""
+		Args
+		-------
+			`attractions` (`list`): Attractions to consider.
+			`max_date` (`datetime`, optional): End of the month considered, now by default.
+
+		Returns
+		-------
+			`float`: Average waiting time of the attractions over the month before `max_date`
+		"""
+		max_date = pd.Timestamp.today() if max_date is None else pd.Timestamp(max_date)
+		attraction = self.daily.index.get_level_values(0)
+		days = self.daily.index.get_level_values(1)
+		window = attraction.isin(attractions) & (days >= max_date - pd.DateOffset(months=1)) & (days <= max_date)
+		total, count = self.daily.loc[window, ['sum', 'count']].sum()
+		return total / count if count else np.nan
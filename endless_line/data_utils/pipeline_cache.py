@@ -0,0 +1,80 @@
+import hashlib
+import os
+from typing import Dict, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+class PipelineCache:
+	"""A store for the intermediate tables of the clean -> preprocess -> merge pipeline.
+
+	Every pipeline step is keyed by the pipeline code version, the step name and the
+	fingerprints of the source files it is derived from. The tables produced by a step
+	are written as Arrow IPC files named `<attribute>.<step>.<key>.arrow` (which, unlike
+	Parquet, round-trips second-resolution datetimes and indexes exactly), so a step is
+	only recomputed when one of its inputs or the pipeline code changes.
+
+	Attributes
+	----------
+		`cache_dir` (`str`): Directory where the materialized tables are stored.
+		`code_version` (`str`): Digest of the pipeline code, part of every key.
+
+	Methods
+	-------
+		`key(step: str, fingerprints: List[str], extra: str = "")` -> `str`: Key of a step.
+		`has(step: str, key: str, attributes: List[str])` -> `bool`: Whether a step is materialized.
+		`load(step: str, key: str, attributes: List[str])` -> `Dict[str, pd.DataFrame]`: Load a step outputs.
+		`save(step: str, key: str, tables: Dict[str, pd.DataFrame])` -> `None`: Store a step outputs.
+	"""
+	def __init__(self, cache_dir: str, code_version: str):
+		self.cache_dir = cache_dir
+		self.code_version = code_version
+
+	def key(self, step: str, fingerprints: List[str], extra: str = "") -> str:
+		"""Compute the key of a pipeline step.
+
+		Args
+		-------
+			`step` (`str`): Name of the step.
+			`fingerprints` (`List[str]`): Fingerprints of the source files the step depends on.
+			`extra` (`str`, optional): Any other value the step output depends on.
+
+		Returns
+		-------
+			`str`: A short hexadecimal digest.
+		"""
+		digest = hashlib.sha1()
+		for part in [self.code_version, pd.__version__, step, extra] + list(fingerprints):
+			digest.update(part.encode())
+			digest.update(b"\0")
+		return digest.hexdigest()[:16]
+
+	def _path(self, attribute: str, step: str, key: str) -> str:
+		return os.path.join(self.cache_dir, f"{attribute}.{step}.{key}.arrow")
+
+	def has(self, step: str, key: str, attributes: List[str]) -> bool:
+		"""Whether every output of a step is materialized for the given key."""
+		return all(os.path.exists(self._path(attribute, step, key)) for attribute in attributes)
+
+	def load(self, step: str, key: str, attributes: List[str]) -> Dict[str, pd.DataFrame]:
+		"""Load the materialized outputs of a step.
+
+		Returns
+		-------
+			`Dict[str, pd.DataFrame]`: The tables, by attribute name.
+		"""
+		return {attribute: feather.read_table(self._path(attribute, step, key)).to_pandas() for attribute in attributes}
+
+	def save(self, step: str, key: str, tables: Dict[str, pd.DataFrame]) -> None:
+		"""Store the outputs of a step, replacing older versions of the same step."""
+		os.makedirs(self.cache_dir, exist_ok=True)
+		for attribute, df in tables.items():
+			prefix = f"{attribute}.{step}."
+			for old in os.listdir(self.cache_dir):
+				if old.startswith(prefix) and old.endswith(".arrow"):
+					os.remove(os.path.join(self.cache_dir, old))
+			path = self._path(attribute, step, key)
+			feather.write_feather(pa.Table.from_pandas(df), path + ".tmp")
+			os.replace(path + ".tmp", path)
@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+
+class RemoteStore:
+	"""A local mirror of the objects of the B2/S3 bucket.
+
+	Objects are downloaded once into `cache_dir` together with their ETag. Later
+	requests only issue a HEAD request to compare ETags (at most once every `ttl`
+	seconds per object) and download the object again only when it changed.
+
+	Attributes
+	----------
+		`bucket` (`str`): Name of the bucket.
+		`client`: The `boto3` S3 client, shared by every store of the process.
+		`cache_dir` (`str`): Directory where the objects are mirrored.
+		`ttl` (`float`): Seconds during which a validated local copy is served without any request.
+
+	Methods
+	-------
+		`exists(key: str)` -> `bool`: Whether an object exists in the bucket.
+		`fetch(key: str)` -> `str`: Path of an up-to-date local copy of an object.
+		`open(key: str)`: Context manager streaming an object, through its local copy when up to date.
+	"""
+	def __init__(self, bucket: str, client, cache_dir: str, ttl: float = 60):
+		self.bucket = bucket
+		self.client = client
+		self.cache_dir = cache_dir
+		self.ttl = ttl
+		self._validated = {}
+		self._lock = threading.Lock()
+
+	def _head(self, key: str):
+		"""HEAD request on an object, `None` if the object does not exist."""
+		try:
+			return self.client.head_object(Bucket=self.bucket, Key=key)
+		except ClientError as e:
+			if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+				return None
+			raise
+
+	def exists(self, key: str) -> bool:
+		"""Whether an object exists in the bucket."""
+		return self._head(key) is not None
+
+	def _check(self, key: str):
+		"""Validate the local copy of an object.
+
+		Returns
+		-------
+			`tuple`: Path of the local copy, and `True` if it must be downloaded again.
+
+		Raises
+		-------
+			`ValueError`: If the object is not found in the bucket
+		"""
+		path = os.path.join(self.cache_dir, key)
+		with self._lock:
+			validated = self._validated.get(key)
+		if validated is not None and time.monotonic() - validated < self.ttl and os.path.exists(path):
+			return path, False
+
+		head = self._head(key)
+		if head is None:
+			raise ValueError(f"File {key} not found in {self.bucket}")
+		local_etag = None
+		if os.path.exists(path) and os.path.exists(path + ".etag"):
+			with open(path + ".etag") as f:
+				local_etag = json.load(f).get("ETag")
+		if local_etag != head["ETag"]:
+			return path, True
+		self._mark_validated(key)
+		return path, False
+
+	def _mark_validated(self, key: str) -> None:
+		with self._lock:
+			self._validated[key] = time.monotonic()
+
+	def fetch(self, key: str) -> str:
+		"""Return the path of an up-to-date local copy of an object.
+
+		Args
+		-------
+			`key` (`str`): Key of the object in the bucket.
+
+		Returns
+		-------
+			`str`: Path of the local copy.
+
+		Raises
+		-------
+			`ValueError`: If the object is not found in the bucket
+		"""
+		path, stale = self._check(key)
+		if stale:
+			with self._download(key, path) as f:
+				while f.read(1 << 20):
+					pass
+		return path
+
+	@contextmanager
+	def open(self, key: str):
+		"""Open an object as a binary stream.
+
+		The local copy is used when it is up to date. Otherwise the body of the object is
+		streamed from the bucket and written to the local copy as it is read, so that the
+		object is never held in memory as a whole.
+
+		Args
+		-------
+			`key` (`str`): Key of the object in the bucket.
+
+		Raises
+		-------
+			`ValueError`: If the object is not found in the bucket
+		"""
+		path, stale = self._check(key)
+		if stale:
+			with self._download(key, path) as f:
+				yield f
+		else:
+			with open(path, "rb") as f:
+				yield f
+
+	@contextmanager
+	def _download(self, key: str, path: str):
+		"""Stream the body of an object while writing it to its local copy."""
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		obj = self.client.get_object(Bucket=self.bucket, Key=key)
+		tmp = f"{path}.{threading.get_ident()}.tmp"
+		try:
+			with open(tmp, "wb") as sink:
+				stream = _TeeStream(obj["Body"], sink)
+				yield stream
+				# the consumer may stop before the end of the body
+				while stream.read(1 << 20):
+					pass
+		except BaseException:
+			if os.path.exists(tmp):
+				os.remove(tmp)
+			raise
+		os.replace(tmp, path)
+		with open(path + ".etag", "w") as f:
+			json.dump({"ETag": obj["ETag"]}, f)
+		self._mark_validated(key)
+
+
+class _TeeStream:
+	"""A readable stream that copies everything read from `source` into `sink`."""
+	def __init__(self, source, sink):
+		self.source = source
+		self.sink = sink
+
+	def read(self, size: int = -1) -> bytes:
+		data = self.source.read(size) if size is not None and size >= 0 else self.source.read()
+		self.sink.write(data)
+		return data
+
+	def readable(self) -> bool:
+		return True
+
+
+@lru_cache(maxsize=None)
+def _client(endpoint: str, key_id: str, key_app_key: str, max_pool_connections: int = 16):
+	"""One pooled S3 client per endpoint and credentials, shared by the whole process."""
+	config = Config(signature_version="s3v4", max_pool_connections=max_pool_connections)
+	return boto3.session.Session().client(
+		service_name="s3",
+		config=config,
+		endpoint_url=endpoint,
+		aws_access_key_id=key_id,
+		aws_secret_access_key=key_app_key,
+	)
+
+
+@lru_cache(maxsize=None)
+def get_store(root_dir: str, cache_dir: str) -> RemoteStore:
+	"""Return the process-wide `RemoteStore` of the bucket configured in `<root_dir>/.secret`.
+
+	Raises
+	-------
+		`ValueError`: If the environment variables are not set
+	"""
+	load_dotenv(os.path.join(root_dir, ".secret"))
+	key_id = os.getenv("B2keyID")
+	db_name = os.getenv("B2DBNAME")
+	key_name = os.getenv("B2keyNAME")
+	key_app_key = os.getenv("B2keyAPPKEY")
+	endpoint = os.getenv("B2endpoint")
+	if not key_id or not db_name or not key_name or not key_app_key or not endpoint:
+		raise ValueError("Environment variables not set")
+	return RemoteStore(db_name, _client(endpoint, key_id, key_app_key), cache_dir)
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+from typing import Callable
+
+import pandas as pd
+
+# Explicit dtypes applied once when a source file is converted to a snapshot,
+# so that the cleaning steps receive already-typed columns, the date column used
+# by row filters, and whether attractions are columns ("wide") rather than rows.
+SOURCE_DTYPES = {
+	"attendance.csv": {
+		"date": "USAGE_DATE",
+		"datetime": ["USAGE_DATE"],
+		"category": ["FACILITY_NAME"],
+	},
+	"entity_schedule.csv": {
+		"date": "WORK_DATE",
+		"datetime": ["WORK_DATE", "DEB_TIME", "FIN_TIME", "UPDATE_TIME"],
+		"category": ["ENTITY_DESCRIPTION_SHORT"],
+	},
+	"waiting_times.csv": {
+		"date": "WORK_DATE",
+		"datetime": ["WORK_DATE", "DEB_TIME", "FIN_TIME"],
+		"category": ["ENTITY_DESCRIPTION_SHORT"],
+	},
+	"fictional_waiting_times.csv": {
+		"date": "WORK_DATE",
+		"datetime": ["WORK_DATE", "DEB_TIME", "FIN_TIME"],
+		"category": ["ENTITY_DESCRIPTION_SHORT"],
+	},
+	"lstm_attraction_wait_times.csv": {
+		"date": "DEB_TIME",
+		"wide": True,
+		"datetime": ["DEB_TIME"],
+		"category": [],
+	},
+	"parade_night_show.xlsx": {
+		"date": "WORK_DATE",
+		"datetime": ["WORK_DATE"],
+		"category": [],
+	},
+}
+
+
+class TableCache:
+	"""A columnar on-disk cache for the raw source tables.
+
+	Each source file is parsed once, typed according to `SOURCE_DTYPES` and written
+	as a Parquet snapshot in `cache_dir`. Subsequent loads are served from the
+	snapshot as long as the source fingerprint (size, mtime and optionally a content
+	hash) and the reader arguments are unchanged.
+
+	Attributes
+	----------
+		`cache_dir` (`str`): Directory where the snapshots are stored.
+		`hash_content` (`bool`): Whether the fingerprint includes a SHA-1 of the file content.
+
+	Methods
+	-------
+		`fingerprint(path: str, **read_kwargs)` -> `str`: Fingerprint of a source file.
+		`load(path: str, reader: Callable, **read_kwargs)` -> `pd.DataFrame`: Load a table through the cache.
+		`clear()` -> `None`: Remove every snapshot from the cache directory.
+	"""
+	def __init__(self, cache_dir: str, hash_content: bool = False):
+		self.cache_dir = cache_dir
+		self.hash_content = hash_content
+
+	def fingerprint(self, path: str, **read_kwargs) -> str:
+		"""Compute the fingerprint of a source file.
+
+		Args
+		-------
+			`path` (`str`): Path of the source file.
+			`read_kwargs`: Arguments given to the reader, part of the key.
+
+		Returns
+		-------
+			`str`: A short hexadecimal digest identifying the file version.
+		"""
+		stat = os.stat(path)
+		key = hashlib.sha1()
+		key.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+		key.update(json.dumps(read_kwargs, sort_keys=True, default=str).encode())
+		key.update(json.dumps(SOURCE_DTYPES.get(os.path.basename(path), {}), sort_keys=True).encode())
+		if self.hash_content:
+			with open(path, "rb") as f:
+				for block in iter(lambda: f.read(1 << 20), b""):
+					key.update(block)
+		return key.hexdigest()[:16]
+
+	def load(self, path: str, reader: Callable[..., pd.DataFrame], columns: list = None, filters: list = None, **read_kwargs) -> pd.DataFrame:
+		"""Load a table from its snapshot, creating the snapshot if needed.
+
+		Args
+		-------
+			`path` (`str`): Path of the source file.
+			`reader` (`Callable`): Function parsing the source file (e.g. `pd.read_csv`).
+			`columns` (`list`, optional): Columns to read from the snapshot, all by default.
+			`filters` (`list`, optional): Row predicates pushed down to the snapshot read, in the
+				disjunctive normal form of `pyarrow.parquet.read_table`. They are only applied when the
+				snapshot already exists, so callers must still filter the result.
+			`read_kwargs`: Arguments given to `reader`.
+
+		Returns
+		-------
+			`pd.DataFrame`: The typed table.
+		"""
+		name = os.path.basename(path)
+		# sources with the same name in different directories (e.g. the bucket mirror) get their own snapshots
+		prefix = f"{name}.{hashlib.sha1(os.path.dirname(os.path.abspath(path)).encode()).hexdigest()[:8]}."
+		snapshot = os.path.join(self.cache_dir, f"{prefix}{self.fingerprint(path, **read_kwargs)}.parquet")
+		if os.path.exists(snapshot):
+			return pd.read_parquet(snapshot, columns=columns, filters=filters)
+
+		df = self.apply_dtypes(reader(path, **read_kwargs), name)
+		os.makedirs(self.cache_dir, exist_ok=True)
+		# remove stale snapshots of the same source before writing the new one
+		for old in os.listdir(self.cache_dir):
+			if old.startswith(prefix) and old.endswith(".parquet"):
+				os.remove(os.path.join(self.cache_dir, old))
+		tmp = snapshot + ".tmp"
+		df.to_parquet(tmp)
+		os.replace(tmp, snapshot)
+		return df if columns is None else df[columns]
+
+	def apply_dtypes(self, df: pd.DataFrame, name: str) -> pd.DataFrame:
+		"""Coerce the columns of a freshly parsed table to their explicit dtypes.
+
+		Args
+		-------
+			`df` (`pd.DataFrame`): The parsed table.
+			`name` (`str`): File name of the source, used to look up `SOURCE_DTYPES`.
+
+		Returns
+		-------
+			`pd.DataFrame`: The typed table.
+		"""
+		dtypes = SOURCE_DTYPES.get(name, {})
+		for col in dtypes.get("datetime", []):
+			if col in df.columns:
+				df[col] = pd.to_datetime(df[col], errors="coerce")
+		for col in dtypes.get("category", []):
+			if col in df.columns:
+				df[col] = df[col].astype("category")
+		return df
+
+	def clear(self) -> None:
+		"""Remove every snapshot from the cache directory."""
+		if not os.path.isdir(self.cache_dir):
+			return
+		for name in os.listdir(self.cache_dir):
+			if name.endswith(".parquet"):
+				os.remove(os.path.join(self.cache_dir, name))
@@ -1,5 +1,11 @@
 from dotenv import load_dotenv
+import copy
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import requests
 import pandas as pd
 from endless_line.data_utils.dataloader import DataLoader
@@ -7,72 +13,338 @@ from datetime import datetime
 from warnings import filterwarnings
 filterwarnings('ignore')
 
+FORECAST_URL = 'https://api.openweathermap.org/data/2.5/forecast?'
+# Minimum delay between two API calls of the process (the free plan allows 60 calls per minute)
+API_MIN_INTERVAL = 1.0
+# Coordinates of the parks of link_attraction_park.csv
+PARK_COORDINATES = {
+	'PortAventura World': (41.087, 1.156),
+	'Tivoli Gardens': (55.6737, 12.5681),
+}
+# Park of the attendance and wait time data
+DEFAULT_PARK = 'PortAventura World'
+
+# Fields kept from the `main` and `weather` objects of every forecast stamp
+MAIN_FIELDS = ['temp', 'feels_like', 'pressure', 'humidity']
+WEATHER_FIELDS = ['main', 'description', 'icon']
+# Descriptions of the API matched to those of the historical weather data
+MATCH_DESCRIPTION = {
+	'clear sky': 'sky is clear',
+	'few clouds: 11-25%': 'few clouds',
+	'scattered clouds: 25-50%': 'scattered clouds',
+	'broken clouds: 51-84%': 'broken clouds',
+	'overcast clouds: 85-100%': 'overcast clouds',
+}
+
+# Cleaned forecasts of the process, by (lat, lon, units): (monotonic time of the fetch, forecast)
+_forecasts = {}
+_refreshing = set()
+_forecasts_lock = threading.Lock()
+# One lock per (lat, lon, units), so that concurrent misses on a forecast fetch it once
+_fetch_locks = {}
+
+
+class _RateLimiter:
+	"""Spaces out calls by at least `interval` seconds, across threads."""
+	def __init__(self, interval: float):
+		self.interval = interval
+		self._next = 0.0
+		self._lock = threading.Lock()
+
+	def wait(self) -> None:
+		with self._lock:
+			now = time.monotonic()
+			delay = self._next - now
+			self._next = max(now, self._next) + self.interval
+		if delay > 0:
+			time.sleep(delay)
+
+
+_rate_limiter = _RateLimiter(API_MIN_INTERVAL)
+
+
+@lru_cache(maxsize=None)
+def _session() -> requests.Session:
+	"""One HTTP session per process, so that connections to the API are reused."""
+	return requests.Session()
+
+
+def at_hour(forecast: pd.DataFrame, selected_date=None, selected_hour=12) -> pd.DataFrame:
+	"""
+	Rows of a forecast at one hour of one day, the whole forecast when no day is selected.
+	"""
+	if selected_date is None:
+		return forecast
+	# Selected date format: 2025-02-12
+	# Desired format: 2025-02-12 12:00:00
+	new_date_str = selected_date + f' {selected_hour}:00:00'
+	return forecast[forecast['dt_iso'] == new_date_str]
+
+
 class WeatherForecast:
-	def __init__(self):
+	def __init__(self, ttl: float = 3 * 3600, max_stale: float = 3 * 3600, fixture: str = None):
 		"""
 		Initialize the WeatherForecast class.
+
+		Forecasts are cached for the whole process by (lat, lon, units). A forecast younger than
+		`ttl` seconds is served as is; OpenWeatherMap updates its forecasts every 3 hours. An older
+		one, up to `ttl + max_stale` seconds, is still served while it is refreshed in the background.
+
+		Args:
+			ttl: Seconds during which a cached forecast is fresh.
+			max_stale: Extra seconds during which a stale forecast is served while being refreshed.
+			fixture: Path of a saved API response (JSON) to use instead of the API, for offline use.
+				Defaults to the WEATHER_FORECAST_FIXTURE environment variable.
 		"""
 		data = DataLoader()
-		if load_dotenv(os.path.join(data.root_dir, '.secret')) or os.getenv("OPENWEATHERMAP_API_KEY"):
-			self.weather_api_key = os.getenv("OPENWEATHERMAP_API_KEY")
-		else:
+		load_dotenv(os.path.join(data.root_dir, '.secret'))
+		self.ttl = ttl
+		self.max_stale = max_stale
+		self.fixture = fixture or os.getenv("WEATHER_FORECAST_FIXTURE")
+		self.weather_api_key = os.getenv("OPENWEATHERMAP_API_KEY")
+		if not self.weather_api_key and not self.fixture:
 			raise ValueError(".secret file not found, please create .secret file in the root directory with your API keys")
 
-	def get_forecast(self, selected_date=None, selected_hour=12, lat: float=48.873492, lon: float=2.295104):
-		url = 'https://api.openweathermap.org/data/2.5/forecast?'
+	def get_forecast(self, selected_date=None, selected_hour=12, lat: float=None, lon: float=None, units: str='metric', park: str=DEFAULT_PARK):
+		"""
+		Forecast of one location, the coordinates of `park` unless `lat` and `lon` are given.
+		"""
+		if lat is None or lon is None:
+			lat, lon = PARK_COORDINATES[park]
+		return at_hour(self._cached_forecast(lat, lon, units), selected_date, selected_hour)
+
+	def get_forecasts(self, parks: list = None, units: str = 'metric', max_workers: int = 4) -> pd.DataFrame:
+		"""
+		Forecasts of several parks, fetched concurrently (and rate limited) when they are not cached.
+
+		Args:
+			parks: Parks of PARK_COORDINATES, all of them by default.
+			units: Units of the API.
+			max_workers: Maximum number of concurrent API calls.
+
+		Returns:
+			pd.DataFrame: The hourly forecasts of the parks, in a long frame with a `park` column.
+		"""
+		if parks is None:
+			parks = list(PARK_COORDINATES)
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			forecasts = executor.map(lambda park: self._cached_forecast(*PARK_COORDINATES[park], units), parks)
+			forecast_df = pd.concat([forecast.assign(park=park) for park, forecast in zip(parks, forecasts)], ignore_index=True)
+		return forecast_df[['park'] + [col for col in forecast_df.columns if col != 'park']]
+
+	def park_forecast(self, park: str = DEFAULT_PARK, selected_date=None, selected_hour=12, units: str = 'metric') -> pd.DataFrame:
+		"""
+		Forecast of one park, from the process cache. Only this park is fetched on a miss, use
+		get_forecasts() to fetch several parks at once.
+
+		Args:
+			park: Park of PARK_COORDINATES.
+			selected_date: Day to keep (e.g. 2025-02-12), the whole forecast by default.
+			selected_hour: Hour to keep on the selected day.
+			units: Units of the API.
+
+		Returns:
+			pd.DataFrame: The hourly forecast of the park, without the `park` column.
+		"""
+		if park not in PARK_COORDINATES:
+			raise ValueError(f"No coordinates for the park {park}, known parks: {list(PARK_COORDINATES)}")
+		return at_hour(self._cached_forecast(*PARK_COORDINATES[park], units), selected_date, selected_hour)
+
+	def _cached_forecast(self, lat: float, lon: float, units: str) -> pd.DataFrame:
+		"""
+		Cleaned forecast from the process cache, fetched again when it is missing or too old.
+		Concurrent misses on the same forecast wait for a single fetch.
+		"""
+		key = (lat, lon, units)
+		with _forecasts_lock:
+			entry = _forecasts.get(key)
+			age = time.monotonic() - entry[0] if entry is not None else None
+			if age is not None and age >= self.ttl and age < self.ttl + self.max_stale and key not in _refreshing:
+				# stale while revalidate
+				_refreshing.add(key)
+				threading.Thread(target=self._refresh, args=key, kwargs={'background': True}, daemon=True).start()
+		if age is not None and age < self.ttl + self.max_stale:
+			return entry[1].copy()
+		with _forecasts_lock:
+			fetch_lock = _fetch_locks.setdefault(key, threading.Lock())
+		with fetch_lock:
+			# another caller may have fetched it while this one was waiting
+			with _forecasts_lock:
+				entry = _forecasts.get(key)
+			if entry is not None and time.monotonic() - entry[0] < self.ttl + self.max_stale:
+				return entry[1].copy()
+			return self._refresh(lat, lon, units).copy()
+
+	def _refresh(self, lat: float, lon: float, units: str, background: bool = False) -> pd.DataFrame:
+		"""
+		Fetch and clean a forecast, and store it in the process cache.
+		Errors of background refreshes are printed, the stale forecast is kept.
+		"""
+		key = (lat, lon, units)
+		try:
+			forecast = self.clean_forecast(self.fetch(lat, lon, units))
+			with _forecasts_lock:
+				_forecasts[key] = (time.monotonic(), forecast)
+			return forecast
+		except Exception as e:
+			if not background:
+				raise
+			print(f"Error refreshing the weather forecast: {e}")
+		finally:
+			if background:
+				with _forecasts_lock:
+					_refreshing.discard(key)
+
+	def fetch(self, lat: float, lon: float, units: str = 'metric') -> dict:
+		"""
+		Raw forecast from the OpenWeatherMap API, or from the fixture file in offline mode.
+		"""
+		if self.fixture:
+			with open(self.fixture) as f:
+				return json.load(f)
+		_rate_limiter.wait()
 		params = {
 					'lat': lat,
 					'lon': lon,
-					'units': 'metric',
+					'units': units,
 					'appid': self.weather_api_key
 		}
-		forecast = requests.get(url, params=params).json()
-		cleaned_forecast = self.clean_forecast(forecast)
-		if selected_date is None:
-			return cleaned_forecast
-		# Selected date format: 2025-02-12
-		# Desired format: 2025-02-12 12:00:00
-		new_date_str = selected_date + f' {selected_hour}:00:00'
-		cleaned_forecast = cleaned_forecast[cleaned_forecast['dt_iso'] == new_date_str]
-		return cleaned_forecast
-
-	def clean_forecast(self, forecast):
-		"""
-		Clean the forecast data.
-		"""
-		# Clean forecast data
-		for stamp in forecast['list']:
-			for info in stamp['main']:
-				if info in ['sea_level', 'grnd_level', 'temp_min', 'temp_max', 'temp_kf']:
-					continue
-				stamp[info] = stamp['main'][info]
-			# Matching weather description
-			match_description = {
-				'clear sky': 'sky is clear',
-				'few clouds: 11-25%': 'few clouds',
-				'scattered clouds: 25-50%': 'scattered clouds',
-				'broken clouds: 51-84%': 'broken clouds',
-				'overcast clouds: 85-100%': 'overcast clouds',
-			}
-			for info in stamp['weather'][0]:
-				if info in ['id']:
-					continue
-				elif info == 'description':
-					stamp[f'weather_{info}'] = match_description.get(stamp['weather'][0]['description'], stamp['weather'][0]['description'])
-				else:
-					stamp[f'weather_{info}'] = stamp['weather'][0][info]
-			# Add clouds and wind speed
-			stamp['clouds_all'] = stamp['clouds']['all']
-			stamp['wind_speed'] = stamp['wind']['speed']
-			# Remove useless keys
-			keys_to_remove = {'sys', 'rain', 'weather', 'clouds', 'main', 'wind', 'pop', 'dt', 'visibility'}
-			for key in keys_to_remove:
-				stamp.pop(key, None)
-		forecast_df = pd.DataFrame(forecast['list'])
-		forecast_df['dt_txt'] = pd.to_datetime(forecast_df['dt_txt'], format='%Y-%m-%d %H:%M:%S')
-		forecast_df.rename(columns={'dt_txt': 'dt_iso'}, inplace=True)
-		# Resample and interpolate 3-hourly data to hourly data with forward fill
-		forecast_df = forecast_df.set_index('dt_iso').resample('h').interpolate(method='ffill', limit_direction='forward')
-		forecast_df.reset_index(inplace=True)
+		response = _session().get(FORECAST_URL, params=params, timeout=10)
+		response.raise_for_status()
+		return response.json()
+
+	def clean_forecast(self, forecast: dict) -> pd.DataFrame:
+		"""
+		Clean the forecast data: one row per hour, with the weather columns of the historical data.
+		"""
+		return self.clean_forecasts({0: forecast}).drop(columns='location')
+
+	@staticmethod
+	def clean_forecasts(forecasts: dict) -> pd.DataFrame:
+		"""
+		Clean several forecasts at once.
+
+		The fields of every 3-hourly stamp of every payload are extracted in a single columnar
+		pass, then each location is forward filled to an hourly resolution.
+
+		Args:
+			forecasts: Raw API responses, by location key.
+
+		Returns:
+			pd.DataFrame: The hourly forecasts, with a `location` column holding the keys of `forecasts`.
+		"""
+		stamps = [stamp for forecast in forecasts.values() for stamp in forecast['list']]
+		main = [stamp['main'] for stamp in stamps]
+		weather = [stamp['weather'][0] for stamp in stamps]
+		forecast_df = pd.DataFrame({
+			'location': [location for location, forecast in forecasts.items() for _ in forecast['list']],
+			'dt_iso': pd.to_datetime([stamp['dt_txt'] for stamp in stamps], format='%Y-%m-%d %H:%M:%S'),
+			**{info: [values.get(info) for values in main] for info in MAIN_FIELDS},
+			**{f'weather_{info}': [values.get(info) for values in weather] for info in WEATHER_FIELDS},
+			'clouds_all': [stamp['clouds']['all'] for stamp in stamps],
+			'wind_speed': [stamp['wind']['speed'] for stamp in stamps],
+		}).astype({info: float for info in MAIN_FIELDS + ['clouds_all', 'wind_speed']})
+		# Matching weather description
+		forecast_df['weather_description'] = forecast_df['weather_description'].replace(MATCH_DESCRIPTION)
+		# Resample 3-hourly data to hourly data with forward fill
+		hourly = [
+			group.drop(columns='location').set_index('dt_iso').resample('h').ffill().reset_index().assign(location=location)
+			for location, group in forecast_df.groupby('location', sort=False)
+		]
+		forecast_df = pd.concat(hourly, ignore_index=True) if hourly else forecast_df
 		## TO DO CHECK OPENING TIMES OF PARK AND REMOVE DATA OUTSIDE OF OPENING TIMES
-		return forecast_df
+		return forecast_df[['location'] + [col for col in forecast_df.columns if col != 'location']]
+
+
+def _clean_forecast_per_stamp(forecast: dict) -> pd.DataFrame:
+	"""
+	The per-stamp parser clean_forecasts() replaced, kept as the reference of benchmark_clean_forecasts().
+	It consumes the payload: the stamps are rewritten in place.
+	"""
+	for stamp in forecast['list']:
+		for info in stamp['main']:
+			if info in ['sea_level', 'grnd_level', 'temp_min', 'temp_max', 'temp_kf']:
+				continue
+			stamp[info] = stamp['main'][info]
+		for info in stamp['weather'][0]:
+			if info in ['id']:
+				continue
+			elif info == 'description':
+				stamp[f'weather_{info}'] = MATCH_DESCRIPTION.get(stamp['weather'][0]['description'], stamp['weather'][0]['description'])
+			else:
+				stamp[f'weather_{info}'] = stamp['weather'][0][info]
+		stamp['clouds_all'] = stamp['clouds']['all']
+		stamp['wind_speed'] = stamp['wind']['speed']
+		for key in {'sys', 'rain', 'weather', 'clouds', 'main', 'wind', 'pop', 'dt', 'visibility'}:
+			stamp.pop(key, None)
+	forecast_df = pd.DataFrame(forecast['list'])
+	forecast_df['dt_txt'] = pd.to_datetime(forecast_df['dt_txt'], format='%Y-%m-%d %H:%M:%S')
+	forecast_df.rename(columns={'dt_txt': 'dt_iso'}, inplace=True)
+	forecast_df = forecast_df.set_index('dt_iso').resample('h').interpolate(method='ffill', limit_direction='forward')
+	return forecast_df.reset_index()
+
+
+def weather_payloads(weather: pd.DataFrame, stamps: int = 40) -> dict:
+	"""
+	API-like payloads built from the historical weather: one stamp every 3 hours, `stamps` stamps
+	(5 days by default, like the API) per payload.
+
+	Args:
+		weather: Rows of weather_data.csv.
+		stamps: Number of stamps of a payload.
+
+	Returns:
+		dict: The payloads, by location key.
+	"""
+	weather = weather.assign(dt_txt=pd.to_datetime(weather['dt_iso'], format='%Y-%m-%d %H:%M:%S %z UTC').dt.strftime('%Y-%m-%d %H:%M:%S'))
+	weather = weather.iloc[::3]
+	stamp_list = [{
+		'dt': int(row.dt),
+		'main': {
+			'temp': row.temp, 'feels_like': row.feels_like, 'temp_min': row.temp_min, 'temp_max': row.temp_max,
+			'pressure': row.pressure, 'sea_level': row.sea_level, 'grnd_level': row.grnd_level,
+			'humidity': row.humidity, 'temp_kf': 0,
+		},
+		'weather': [{'id': row.weather_id, 'main': row.weather_main, 'description': row.weather_description, 'icon': row.weather_icon}],
+		'clouds': {'all': row.clouds_all},
+		'wind': {'speed': row.wind_speed, 'deg': row.wind_deg, 'gust': row.wind_gust},
+		'visibility': row.visibility,
+		'pop': 0,
+		'sys': {'pod': 'd'},
+		'dt_txt': row.dt_txt,
+	} for row in weather.itertuples(index=False)]
+	return {location: {'list': stamp_list[first:first + stamps]} for location, first in enumerate(range(0, len(stamp_list) - stamps + 1, stamps))}
+
+
+def benchmark_clean_forecasts(stamps: int = 40, repeat: int = 3) -> pd.DataFrame:
+	"""
+	Compare the per-stamp parser with the batched columnar one on payloads built from the historical
+	weather of the data directory (see weather_payloads()), and check that they give the same forecasts.
+
+	Args:
+		stamps: Number of stamps of a payload.
+		repeat: Number of runs of each parser, the best one is kept.
+
+	Returns:
+		pd.DataFrame: The best time of each parser, for all the payloads, and the number of payloads and stamps.
+	"""
+	payloads = weather_payloads(DataLoader().load_file('weather_data.csv'), stamps)
+	n_stamps = sum(len(payload['list']) for payload in payloads.values())
+	rows = {}
+	for name in ('per stamp loop', 'columnar batch'):
+		best = None
+		for _ in range(repeat):
+			# the loop consumes its payloads, copy them out of the timing
+			copies = copy.deepcopy(payloads) if name == 'per stamp loop' else payloads
+			start = time.perf_counter()
+			if name == 'per stamp loop':
+				result = [_clean_forecast_per_stamp(payload) for payload in copies.values()]
+			else:
+				result = WeatherForecast.clean_forecasts(copies)
+			seconds = time.perf_counter() - start
+			best = seconds if best is None else min(best, seconds)
+		rows[name] = (best, len(payloads), n_stamps)
+		if name == 'per stamp loop':
+			expected = pd.concat(result, ignore_index=True)
+	pd.testing.assert_frame_equal(result.drop(columns='location')[expected.columns], expected)
+	return pd.DataFrame.from_dict(rows, orient="index", columns=["seconds", "payloads", "stamps"])
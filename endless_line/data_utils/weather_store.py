@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+HOUR = pd.Timedelta(hours=1).value
+
+
+def _as_times(times) -> pd.DatetimeIndex:
+	"""Timestamps as a nanosecond DatetimeIndex, parsed only if they are not datetimes already."""
+	if not pd.api.types.is_datetime64_any_dtype(times):
+		times = pd.to_datetime(times)
+	return pd.DatetimeIndex(times).as_unit("ns")
+
+
+class WeatherFeatureStore:
+	"""The preprocessed historical weather, indexed by hour.
+
+	The weather features (see `DataLoader.preprocess_weather()`) are stored once in a sorted
+	DatetimeIndex, together with a dense array mapping every hour offset from the first
+	timestamp to its row. Exact lookups of any number of timestamps are then O(1) array reads,
+	and as-of lookups (latest weather at or before a timestamp) a binary search.
+
+	Attributes
+	----------
+		`table` (`pd.DataFrame`): The weather features, indexed by their timestamp (one row per timestamp).
+
+	Methods
+	-------
+		`lookup(times)` -> `pd.DataFrame`: Weather at exactly the given timestamps.
+		`asof(times, tolerance=None)` -> `pd.DataFrame`: Latest weather at or before the given timestamps.
+		`daily(hour: int = 12)` -> `pd.DataFrame`: Weather of every day at a given hour.
+		`save(path: str)` -> `None`: Store the features as an Arrow IPC file.
+		`load(path: str)` -> `WeatherFeatureStore`: Load stored features.
+	"""
+	def __init__(self, weather: pd.DataFrame, time_col: str = "dt_iso"):
+		"""
+		Args
+		-------
+			`weather` (`pd.DataFrame`): Weather features with a timestamp column, or already indexed by timestamp.
+			`time_col` (`str`, optional): Name of the timestamp column.
+		"""
+		if time_col in weather.columns:
+			times = pd.to_datetime(weather[time_col]).astype("datetime64[ns]")
+			weather = weather.drop(columns=time_col).set_axis(pd.DatetimeIndex(times, name=time_col), axis=0)
+		# duplicated timestamps contribute their first row
+		weather = weather[weather.index.notna() & ~weather.index.duplicated()]
+		self.table = weather.sort_index(kind="stable")
+
+		stamps = self.table.index.asi8
+		self._origin = stamps[0] if len(stamps) else 0
+		offsets = stamps - self._origin
+		self._positions = None
+		if len(stamps) and not (offsets % HOUR).any():
+			self._positions = np.full(offsets[-1] // HOUR + 1, -1, dtype=np.int64)
+			self._positions[offsets // HOUR] = np.arange(len(stamps))
+
+	def _take(self, positions: np.ndarray) -> pd.DataFrame:
+		"""Rows at `positions`, NaN where the position is -1, with a RangeIndex."""
+		missing = positions < 0
+		result = self.table.take(np.where(missing, 0, positions))
+		result.index = pd.RangeIndex(len(result))
+		if missing.any():
+			result = result.where(np.broadcast_to(~missing[:, None], result.shape))
+		return result
+
+	def lookup(self, times) -> pd.DataFrame:
+		"""Weather at exactly the given timestamps, NaN for timestamps without weather.
+
+		Args
+		-------
+			`times`: Timestamps (Series, Index or array).
+
+		Returns
+		-------
+			`pd.DataFrame`: One row per timestamp, in the same order, with a RangeIndex
+		"""
+		times = _as_times(times)
+		if self._positions is None:
+			return self._take(self.table.index.get_indexer(times))
+		# NaT is the smallest int64, so it falls before the first slot
+		slots, remainder = np.divmod(times.asi8 - self._origin, HOUR)
+		inside = (remainder == 0) & (slots >= 0) & (slots < len(self._positions))
+		return self._take(np.where(inside, self._positions[np.where(inside, slots, 0)], -1))
+
+	def asof(self, times, tolerance: pd.Timedelta = None) -> pd.DataFrame:
+		"""Latest weather at or before the given timestamps.
+
+		Args
+		-------
+			`times`: Timestamps (Series, Index or array).
+			`tolerance` (`pd.Timedelta`, optional): Maximum age of the weather, unbounded by default.
+
+		Returns
+		-------
+			`pd.DataFrame`: One row per timestamp, in the same order, with a RangeIndex
+		"""
+		times = _as_times(times)
+		positions = np.searchsorted(self.table.index.asi8, times.asi8, side="right") - 1
+		positions[times.isna()] = -1
+		if tolerance is not None:
+			age = times.asi8 - self.table.index.asi8[np.maximum(positions, 0)]
+			positions[age > pd.Timedelta(tolerance).value] = -1
+		return self._take(positions)
+
+	def daily(self, hour: int = 12) -> pd.DataFrame:
+		"""Weather of every day at `hour`, with the date in the `dt_iso` column and without the `hour` feature."""
+		table = self.table[self.table.index.hour == hour]
+		daily = table.drop(columns=["hour"], errors="ignore").reset_index()
+		daily["dt_iso"] = table.index.date
+		return daily
+
+	def save(self, path: str) -> None:
+		"""Store the features as an Arrow IPC file, written atomically."""
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		feather.write_feather(pa.Table.from_pandas(self.table), path + ".tmp")
+		os.replace(path + ".tmp", path)
+
+	@classmethod
+	def load(cls, path: str) -> "WeatherFeatureStore":
+		"""Load features stored with `save()`."""
+		return cls(feather.read_table(path).to_pandas())
@@ -254,7 +254,7 @@ def update_dashboard(n_clicks, selected_date, selected_hour, closed_attractions,
 
     attendance_widget = create_attendance_widget(predicted_attendance)
 
-    weather_forecast = WeatherForecast().get_forecast(selected_date, selected_hour)
+    weather_forecast = WeatherForecast().park_forecast(selected_date=selected_date, selected_hour=selected_hour)
     if not weather_forecast.empty:
         weather_forecast['dt_iso'] = weather_forecast['dt_iso'].dt.strftime('%Y-%m-%d %H:%M:%S')
         row = json.dumps(weather_forecast.iloc[0].to_dict())
@@ -1,15 +1,15 @@
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
-from endless_line.data_utils.weather_forecast import WeatherForecast
+from endless_line.data_utils.weather_forecast import DEFAULT_PARK, WeatherForecast
 from datetime import datetime, timedelta
 
-def create_weather_forecast_plot(start_date=None, end_date=None):
+def create_weather_forecast_plot(start_date=None, end_date=None, park=DEFAULT_PARK):
     """Create a weather forecast plot with temperature and humidity lines, daily separators, and icons below."""
 
     # Get weather forecast data
     weather = WeatherForecast()
-    forecast_data = weather.get_forecast()
+    forecast_data = weather.park_forecast(park)
 
     if start_date is not None:
         forecast_data = forecast_data[forecast_data['dt_iso'] >= start_date]
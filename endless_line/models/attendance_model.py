@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 from endless_line.data_utils.dataloader import DataLoader
-from endless_line.data_utils.weather_forecast import WeatherForecast
+from endless_line.data_utils.weather_forecast import DEFAULT_PARK, WeatherForecast
 from endless_line.models.model_utils import save_model, load_model
 from sklearn.preprocessing import MinMaxScaler
 from datetime import datetime, timedelta
@@ -23,9 +23,9 @@ def merge_for_attendance_forecasting(df, df_weather):
     return merged_df
 
 
-def call_the_weather_forecast():
+def call_the_weather_forecast(park=DEFAULT_PARK):
     forecast = WeatherForecast()
-    forecast_data = forecast.get_forecast()
+    forecast_data = forecast.park_forecast(park)
 
     # Data augmentation
     forecast_data["day"] = forecast_data["dt_iso"].dt.day
@@ -126,12 +126,16 @@ def train_attendance_model(data, pre_covid=False, save=False):
     m.fit(df_train)
 
     if save:
-        save_model(m, "prophet_model.pkl")
+        save_model(m, "prophet_model", metadata={
+            "training_range": [str(df_train['ds'].min().date()), str(df_train['ds'].max().date())],
+            "features": list(m.extra_regressors),
+            "rows": len(df_train),
+        })
 
     return m
 
 
-def predict_attendance(model, days_to_predict=5):
+def predict_attendance(model, days_to_predict=5, forecast_data=None):
     """
     Uses the trained Prophet model to forecast attendance for the specified
     number of days into the future, relying on actual weather forecasts.
@@ -140,6 +144,8 @@ def predict_attendance(model, days_to_predict=5):
         model (Prophet): A fitted Prophet model.
         df_train (pd.DataFrame): The historical data used for training (in Prophet format).
         days_to_predict (int): Number of future days to forecast (default=5).
+        forecast_data (pd.DataFrame): Weather forecast from call_the_weather_forecast(),
+            fetched if not given.
 
     Returns:
         forecast_future (pd.DataFrame): DataFrame containing at least ['ds', 'yhat'] with forecasts.
@@ -148,7 +154,8 @@ def predict_attendance(model, days_to_predict=5):
         model = load_model(model)
 
     # 1. Get real weather forecast data
-    forecast_data = call_the_weather_forecast()
+    if forecast_data is None:
+        forecast_data = call_the_weather_forecast()
 
     # 2. Combine historical (train) rows with future forecast rows
     #    This ensures that we have the same columns and Prophet can handle them properly.
@@ -179,9 +186,8 @@ def predict_attendance(model, days_to_predict=5):
 
 if __name__ == "__main__":
 	## Usage example ##
-	data = DataLoader(load_all_files=True)
-	data.clean_data()
-	data.data_preprocessing()
+	data = DataLoader()
+	data.run_pipeline(until="preprocess")
 
 	# Train the model
 	model = train_attendance_model(data, pre_covid=False, save=True)
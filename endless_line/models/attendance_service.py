@@ -0,0 +1,123 @@
+import hashlib
+import threading
+import time
+from functools import lru_cache
+
+import pandas as pd
+from endless_line.data_utils.dataloader import DataLoader
+from endless_line.models.attendance_model import call_the_weather_forecast, predict_attendance
+from endless_line.models.model_utils import load_model
+from endless_line.models.registry import get_registry
+
+
+class AttendanceForecastService:
+    """
+    Long-lived attendance forecasts of the Prophet model, shared by the dashboard callbacks.
+
+    The model is read from the model registry once (and again only when it is saved again).
+    The forecast frame is computed once per (model version, weather snapshot) and kept in memory, so looking
+    up the attendance of a date is a dictionary read. Once started, a background thread
+    refreshes the forecast every `refresh_interval` seconds.
+
+    Attributes:
+        model_file (str): Name of the model in the model registry.
+        refresh_interval (float): Seconds between two scheduled refreshes.
+        key (tuple): (model version, weather snapshot) of the current forecast.
+    """
+
+    def __init__(self, model_file="prophet_model", refresh_interval=3600, root_dir=None):
+        self.model_file = model_file
+        self.refresh_interval = refresh_interval
+        self.root_dir = root_dir or DataLoader().root_dir
+        self.model = None
+        self.model_version = None
+        self.key = None
+        self._forecast = None
+        self._by_date = {}
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+
+    def _current_model_version(self):
+        try:
+            return get_registry(self.root_dir).version(self.model_file)
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        """
+        Reload the model if it was saved again, fetch the weather forecast and predict the
+        attendance again if the model or the weather changed.
+
+        Raises:
+            FileNotFoundError: If no model was ever loaded and the model cannot be read
+                (e.g. it was never trained with train_attendance_model(save=True)).
+        """
+        with self._refresh_lock:
+            version = self._current_model_version()
+            if version is not None and version != self.model_version:
+                model = load_model(self.model_file, self.root_dir)
+                if model is not None:
+                    self.model, self.model_version = model, version
+            if self.model is None:
+                raise FileNotFoundError(
+                    f"No attendance model {self.model_file} in {get_registry(self.root_dir).models_dir}, "
+                    "train and save one with train_attendance_model(data, save=True)"
+                )
+
+            weather = call_the_weather_forecast()
+            snapshot = hashlib.sha1(pd.util.hash_pandas_object(weather, index=False).to_numpy().tobytes()).hexdigest()[:16]
+            if (self.model_version, snapshot) == self.key:
+                return
+            forecast = predict_attendance(self.model, forecast_data=weather)
+            # swap the references at once, readers never see a partial update
+            self._by_date = dict(zip(forecast['ds'].dt.date.astype(str), forecast['yhat']))
+            self._forecast = forecast
+            self.key = (self.model_version, snapshot)
+
+    def forecast(self):
+        """
+        Returns:
+            pd.DataFrame: The current forecast, with the columns ['ds', 'yhat'].
+        """
+        if self._forecast is None:
+            self.refresh()
+        return self._forecast.copy()
+
+    def attendance(self, date):
+        """
+        Args:
+            date (str): Date formatted as 2025-02-12.
+
+        Returns:
+            float: The forecasted attendance of that date.
+        """
+        if self._forecast is None:
+            self.refresh()
+        return self._by_date[date]
+
+    def start(self):
+        """Start refreshing the forecast in the background every `refresh_interval` seconds."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        last_error = None
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+                last_error = None
+            except Exception as e:
+                # the same error is reported once, not at every refresh
+                if str(e) != last_error:
+                    print(f"Error refreshing the attendance forecast: {e}")
+                last_error = str(e)
+
+
+@lru_cache(maxsize=None)
+def get_attendance_service(model_file="prophet_model"):
+    """Return the process-wide, scheduled forecast service of a model."""
+    service = AttendanceForecastService(model_file)
+    service.start()
+    return service
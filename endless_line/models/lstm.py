@@ -1,5 +1,4 @@
 import os
-import pickle
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
@@ -12,12 +11,101 @@ from scikeras.wrappers import KerasRegressor
 import matplotlib.pyplot as plt
 import sklearn
 import scikeras
+from endless_line.models.model_utils import save_model
 
-def train_and_save_model(data, model_save_path="lstm_model.pkl"):
-    # Preprocess data
-    data.clean_data()
-    data.data_preprocessing()
-    data.merge()
+
+class SequenceWindows:
+    """
+    (lookback x features) sequences of every attraction, read lazily from a memory-mapped
+    feature matrix.
+
+    The rows are stored sorted by attraction and time in two float32 .npy files, and cut into
+    segments of consecutive slots (one attraction, no gap longer than `max_gap`). A window is a
+    strided view of `lookback` consecutive rows of a segment, and its target is the waiting time
+    `horizon` slots after its last row, so no window is ever copied until it is put in a batch and
+    the memory used does not grow with the history.
+    """
+
+    def __init__(self, features_path, targets_path, segments, lookback=16, horizon=1):
+        self.features = np.load(features_path, mmap_mode="r")
+        self.targets = np.load(targets_path, mmap_mode="r")
+        self.lookback = lookback
+        self.horizon = horizon
+        # (first row, number of windows) of every segment long enough for one window
+        self.segments = [
+            (start, stop - start - lookback - horizon + 1)
+            for start, stop in segments
+            if stop - start >= lookback + horizon
+        ]
+        self.offsets = np.cumsum([0] + [count for _, count in self.segments])
+        self.views = [self.segment_windows(start, count) for start, count in self.segments]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def segment_windows(self, start, count):
+        # (count, lookback, features) view, the window axis comes last in sliding_window_view
+        rows = self.features[start:start + count + self.lookback - 1]
+        windows = np.lib.stride_tricks.sliding_window_view(rows, self.lookback, axis=0).transpose(0, 2, 1)
+        first_target = start + self.lookback - 1 + self.horizon
+        return windows, self.targets[first_target:first_target + count]
+
+    def batches(self, batch_size=32, shuffle=False, seed=None):
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        for first in range(0, len(order), batch_size):
+            indices = order[first:first + batch_size]
+            segment = np.searchsorted(self.offsets, indices, side="right") - 1
+            X, y = [], []
+            for i, position in zip(segment, indices - self.offsets[segment]):
+                windows, targets = self.views[i]
+                X.append(windows[position])
+                y.append(targets[position])
+            yield np.stack(X), np.array(y, dtype=np.float32)
+
+    def dataset(self, batch_size=32, shuffle=False, seed=None):
+        n_features = self.features.shape[1]
+        return tf.data.Dataset.from_generator(
+            lambda: self.batches(batch_size, shuffle, seed),
+            output_signature=(
+                tf.TensorSpec(shape=(None, self.lookback, n_features), dtype=tf.float32),
+                tf.TensorSpec(shape=(None,), dtype=tf.float32),
+            ),
+        ).prefetch(tf.data.AUTOTUNE)
+
+
+def write_sequence_features(frame, feature_columns, cache_dir, target="WAIT_TIME_MAX", max_gap=pd.Timedelta("15min")):
+    """
+    Write the features and target of `frame` (indexed by DEB_TIME, with ENTITY_DESCRIPTION_SHORT)
+    as float32 .npy files, sorted by attraction and time, attraction by attraction.
+
+    Returns the paths of the features and targets files and the (start, stop) rows of the segments
+    of consecutive slots, as expected by SequenceWindows.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    features_path = os.path.join(cache_dir, "features.npy")
+    targets_path = os.path.join(cache_dir, "targets.npy")
+    features = np.lib.format.open_memmap(features_path, mode="w+", dtype=np.float32, shape=(len(frame), len(feature_columns)))
+    targets = np.lib.format.open_memmap(targets_path, mode="w+", dtype=np.float32, shape=(len(frame),))
+
+    segments, row = [], 0
+    for _, group in frame.groupby("ENTITY_DESCRIPTION_SHORT", sort=True):
+        group = group.sort_index(kind="stable")
+        features[row:row + len(group)] = group[feature_columns].to_numpy(dtype=np.float32)
+        targets[row:row + len(group)] = group[target].to_numpy(dtype=np.float32)
+        # a new segment starts after every gap longer than max_gap
+        gaps = np.flatnonzero(np.diff(group.index.to_numpy()) > max_gap.to_timedelta64()) + 1
+        bounds = [0, *gaps.tolist(), len(group)]
+        segments += [(row + start, row + stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+        row += len(group)
+    features.flush()
+    targets.flush()
+    return features_path, targets_path, segments
+
+def train_and_save_model(data, model_name="lstm_model", lookback=16, horizon=1, batch_size=32, cache_dir=None):
+    # Preprocess data (materialized steps are reused when the inputs did not change)
+    data.run_pipeline()
 
     # Mapping for ENTITY_DESCRIPTION_SHORT
     entity_mapping = {
@@ -42,7 +130,10 @@ def train_and_save_model(data, model_save_path="lstm_model.pkl"):
 
     data.merged['DEB_TIME'] = pd.to_datetime(data.merged['DEB_TIME'])
     data.merged = data.merged.sort_values('DEB_TIME').set_index('DEB_TIME')
+    rows = len(data.merged)
     data.merged = data.merged.dropna()
+    if len(data.merged) < rows:
+        print(f"Dropped {rows - len(data.merged)} rows with missing values out of {rows}")
 
     target = 'WAIT_TIME_MAX'
     X = data.merged.drop(columns=["WAIT_TIME_MAX"])
@@ -55,15 +146,17 @@ def train_and_save_model(data, model_save_path="lstm_model.pkl"):
     target = "WAIT_TIME_MAX"
     non_numeric_columns = ["WORK_DATE"]
 
-    X_train = train_data.drop(columns=[target] + non_numeric_columns).values
-    y_train = train_data[target].values
-
-    timesteps = 1
-    X_train_reshaped = X_train.reshape(X_train.shape[0], timesteps, X_train.shape[1])
+    # sequences of `lookback` consecutive slots of an attraction, read from a memory-mapped matrix
+    # written in `cache_dir`, the lstm directory of the cache of the loader by default
+    if cache_dir is None:
+        cache_dir = os.path.join(data.cache.cache_dir if data.cache is not None else os.path.join(data.data_dir_path, ".cache"), "lstm")
+    feature_columns = [col for col in train_data.columns if col not in [target] + non_numeric_columns]
+    paths = write_sequence_features(train_data, feature_columns, cache_dir, target)
+    windows = SequenceWindows(*paths, lookback=lookback, horizon=horizon)
 
     # Define and train the model
     model = Sequential([
-        LSTM(64, input_shape=(X_train_reshaped.shape[1], X_train_reshaped.shape[2]), return_sequences=True),
+        LSTM(64, input_shape=(lookback, len(feature_columns)), return_sequences=True),
         Dropout(0.2),
         LSTM(32, return_sequences=False),
         Dropout(0.2),
@@ -72,11 +165,16 @@ def train_and_save_model(data, model_save_path="lstm_model.pkl"):
     ])
 
     model.compile(optimizer='adam', loss='mse', metrics=['mae'])
-    model.fit(X_train_reshaped, y_train, epochs=50, batch_size=32)
+    history = model.fit(windows.dataset(batch_size, shuffle=True), epochs=50)
 
-    # Save the model
-    with open(model_save_path, 'wb') as f:
-        pickle.dump(model, f)
-    print("Model saved to", model_save_path)
+    # Save the model in the Keras format, with its description in the model registry
+    save_model(model, model_name, data.root_dir, metadata={
+        "training_range": [train_start_date, train_end_date],
+        "features": feature_columns,
+        "lookback": lookback,
+        "horizon": horizon,
+        "metrics": {name: values[-1] for name, values in history.history.items()},
+    })
+    print("Model saved as", model_name)
     
     return model
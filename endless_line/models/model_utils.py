@@ -1,21 +1,14 @@
-import pickle
-import os
-from endless_line.data_utils.dashboard_utils import DataLoader
+from endless_line.data_utils.dataloader import DataLoader
+from endless_line.models.registry import get_registry
 
-def save_model(model, filename, root_dir=DataLoader().root_dir):
-	models_dir = os.path.join(root_dir, "models")
-	filename = os.path.join(models_dir, filename)
-	with open(filename, 'wb') as f:
-		pickle.dump(model, f)
+def save_model(model, filename, root_dir=DataLoader().root_dir, metadata=None):
+	"""Save a model in its native format in the model registry, see ModelRegistry.save()"""
+	return get_registry(root_dir).save(filename, model, metadata)
 
 def load_model(filename, root_dir=DataLoader().root_dir):
-    """Load the Prophet model from a file"""
-    models_dir = os.path.join(root_dir, "models")
-    filename = os.path.join(models_dir, filename)
+    """Load a model from the model registry, read once and then kept in memory"""
     try:
-        with open(filename, 'rb') as f:
-            model = pickle.load(f)
-        return model
+        return get_registry(root_dir).get(filename)
     except Exception as e:
         print(f"Error loading model: {e}")
         return None
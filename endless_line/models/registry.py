@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import pandas as pd
+from endless_line.data_utils.dataloader import DataLoader
+
+MANIFEST = "registry.json"
+
+# Native file format of every kind of model
+EXTENSIONS = {
+    "prophet": ".json",
+    "xgboost": ".ubj",
+    "forecaster": ".ubj",
+    "keras": ".keras",
+}
+
+
+def model_kind(model):
+    """
+    Returns:
+        str: The kind of the model, a key of EXTENSIONS.
+
+    Raises:
+        ValueError: If the model has no native serialization in the registry.
+    """
+    module = type(model).__module__
+    if module.startswith("prophet"):
+        return "prophet"
+    if module.startswith("xgboost"):
+        return "xgboost"
+    if type(model).__name__ == "Forecaster" and module.startswith("endless_line"):
+        return "forecaster"
+    if module.startswith(("keras", "tensorflow", "tf_keras")):
+        return "keras"
+    raise ValueError(f"No native format for models of type {type(model).__name__}")
+
+
+def _write(kind, model, path):
+    if kind == "prophet":
+        from prophet.serialize import model_to_json
+        with open(path, "w") as f:
+            f.write(model_to_json(model))
+    elif kind == "xgboost":
+        model.save_model(path)
+    else:
+        # Forecaster.save() and Keras pick the format from the extension
+        model.save(path)
+
+
+def _read(kind, path):
+    if kind == "prophet":
+        from prophet.serialize import model_from_json
+        with open(path) as f:
+            return model_from_json(f.read())
+    if kind == "xgboost":
+        import xgboost as xgb
+        model = xgb.Booster()
+        model.load_model(path)
+        return model
+    if kind == "forecaster":
+        from endless_line.models.wait_time_model import Forecaster
+        return Forecaster().load(path)
+    from tensorflow import keras
+    return keras.models.load_model(path)
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+class ModelRegistry:
+    """
+    The models of the models directory, stored in their native format instead of pickle.
+
+    Every model is saved with its framework's own serialization (Prophet JSON, XGBoost UBJ,
+    Keras .keras) and described in a registry.json manifest: kind, file, content hash, save
+    time and the metadata given when saving (training range, features, metrics...). Models are
+    only read when first requested, and at most `max_loaded` of them are kept in memory, the
+    least recently used being dropped first. A model saved again gets a new hash, so the next
+    get() reads the new version.
+
+    Models saved with pickle before the registry existed (e.g. prophet_model.pkl) are still
+    loaded from their pickle file as long as they are not in the manifest.
+
+    Attributes:
+        models_dir (str): Directory of the model files and of the manifest.
+        max_loaded (int): Maximum number of models kept in memory.
+    """
+
+    def __init__(self, root_dir=None, max_loaded=4):
+        self.models_dir = os.path.join(root_dir or DataLoader().root_dir, "models")
+        self.max_loaded = max_loaded
+        self._loaded = OrderedDict()
+        self._manifest = {}
+        self._manifest_stat = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def name(filename):
+        """Name of a model from its file name, e.g. prophet_model for prophet_model.pkl."""
+        return os.path.splitext(os.path.basename(filename))[0]
+
+    def manifest(self):
+        """
+        Returns:
+            dict: The manifest entries by model name, read again only when the file changed.
+        """
+        path = os.path.join(self.models_dir, MANIFEST)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return {}
+        if (stat.st_size, stat.st_mtime_ns) != self._manifest_stat:
+            with open(path) as f:
+                self._manifest = json.load(f)
+            self._manifest_stat = (stat.st_size, stat.st_mtime_ns)
+        return self._manifest
+
+    def save(self, name, model, metadata=None):
+        """
+        Save a model in its native format and record it in the manifest.
+
+        Args:
+            name (str): Name of the model (a file name is accepted, its extension is ignored).
+            model: Prophet, XGBoost Booster, Forecaster or Keras model.
+            metadata (dict, optional): Description of the model, e.g. training_range, features and metrics.
+
+        Returns:
+            dict: The manifest entry of the model.
+        """
+        name = self.name(name)
+        kind = model_kind(model)
+        filename = name + EXTENSIONS[kind]
+        path = os.path.join(self.models_dir, filename)
+        os.makedirs(self.models_dir, exist_ok=True)
+        _write(kind, model, path)
+        entry = {
+            "kind": kind,
+            "file": filename,
+            "hash": _file_hash(path),
+            "saved": pd.Timestamp.now().isoformat(timespec="seconds"),
+            **(metadata or {}),
+        }
+        with self._lock:
+            manifest = dict(self.manifest())
+            manifest[name] = entry
+            tmp = os.path.join(self.models_dir, MANIFEST + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump(manifest, f, indent=4, default=str)
+            os.replace(tmp, os.path.join(self.models_dir, MANIFEST))
+            self._loaded.pop(name, None)
+        return entry
+
+    def version(self, name):
+        """
+        Returns:
+            str: The content hash of a registered model, or the size and mtime of a legacy pickle.
+        """
+        name = self.name(name)
+        entry = self.manifest().get(name)
+        if entry is not None:
+            return entry["hash"]
+        stat = os.stat(os.path.join(self.models_dir, name + ".pkl"))
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def metadata(self, name):
+        """
+        Returns:
+            dict: The manifest entry of a model, empty for legacy pickles.
+        """
+        return dict(self.manifest().get(self.name(name), {}))
+
+    def get(self, name):
+        """
+        Returns:
+            The model, read from its file on first use or when it was saved again.
+        """
+        name = self.name(name)
+        version = self.version(name)
+        with self._lock:
+            if name in self._loaded and self._loaded[name][0] == version:
+                self._loaded.move_to_end(name)
+                return self._loaded[name][1]
+
+        entry = self.manifest().get(name)
+        if entry is not None:
+            model = _read(entry["kind"], os.path.join(self.models_dir, entry["file"]))
+        else:
+            with open(os.path.join(self.models_dir, name + ".pkl"), "rb") as f:
+                model = pickle.load(f)
+
+        with self._lock:
+            self._loaded[name] = (version, model)
+            self._loaded.move_to_end(name)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return model
+
+
+@lru_cache(maxsize=None)
+def get_registry(root_dir=None):
+    """Return the process-wide registry of a models directory."""
+    return ModelRegistry(root_dir)
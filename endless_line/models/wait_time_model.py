@@ -11,13 +11,49 @@ from sklearn.preprocessing import MinMaxScaler, LabelEncoder
 from sklearn import preprocessing
 import matplotlib
 from matplotlib import pyplot as plt
+import hashlib
+import json
+import multiprocessing
 import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 from endless_line.models.model_utils import save_model, load_model
 from endless_line.data_utils.dashboard_utils import DataLoader
 
+# Version of the layout of the metadata stored in the saved boosters
+ARTIFACT_VERSION = 1
+# Version of the layout of the tuned parameters saved by wait_time_tuning.tune()
+PARAMS_ARTIFACT_VERSION = 1
+
+
+class _ParquetChunks(xgb.DataIter):
+    """
+        iterates over featured chunks stored as parquet files, so that XGBoost builds an
+        external memory DMatrix (pages cached on disk) instead of holding all the rows in RAM
+    """
+
+    def __init__(self, paths, prepare, cache_prefix):
+        self.paths = paths
+        self.prepare = prepare
+        self._position = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._position == len(self.paths):
+            return False
+        chunk = pd.read_parquet(self.paths[self._position])
+        input_data(data=self.prepare(chunk), label=chunk['WAIT_TIME_MAX'])
+        self._position += 1
+        return True
+
+    def reset(self):
+        self._position = 0
+
+
 class Forecaster():
-    def __init__(self, filename='wait_time_predictor.pkl', csv_name='waiting_time_predicted.csv'):
+    def __init__(self, filename='wait_time_predictor.ubj', csv_name='waiting_time_predicted.csv'):
         self.filename = filename
         self.csv_name = csv_name
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
@@ -37,6 +73,14 @@ class Forecaster():
             'alpha': 0.19936220554480838, 
             'gamma': 0.4233553876209511
         }
+        # maximum number of boosting rounds of fit(), the tuned one after load_params()
+        self.num_boost_round = 1000
+
+        # date ranges seen by the successive boosters, one entry per fit() or update(), in
+        # source dates (WORK_DATE before the shift of the merged data, see source_dates())
+        self.history = []
+        # merged_scaling of the DataLoader that built the training data, see fit()
+        self.data_scaling = None
 
         # based on average waiting time of the attraction on the whole dataset
         self.attraction_encoding = {
@@ -122,7 +166,7 @@ class Forecaster():
         df = df.drop(columns=['FIN_TIME', 'DEB_TIME_HOUR'])
 
         # label encoding of attraction names (ordered by average waiting time)
-        df['attraction_encoded']= df['ENTITY_DESCRIPTION_SHORT'].apply(lambda x: self.attraction_encoding[x])
+        df['attraction_encoded'] = df['ENTITY_DESCRIPTION_SHORT'].map(self.attraction_encoding).astype(int)
         df = df.drop(columns='ENTITY_DESCRIPTION_SHORT')
 
         if train:
@@ -131,9 +175,20 @@ class Forecaster():
 
         return df
 
-    def fit(self, df_train):
+    def fit(self, df_train, quantile=False, tree_method=None, max_bin=256, scaling=None, num_boost_round=None):
         """
-            fitting the model
+            fitting the model, with at most `num_boost_round` rounds (`self.num_boost_round` by default)
+
+            `scaling` is the merged_scaling of the DataLoader that built `df_train`. It is saved
+            with the model, so that predict_grid() can build the calendar features like the merged
+            data: from the dates before the shift, scaled by the DataLoader and then by featuring().
+
+            with `quantile`, the features are cast to float32, `attraction_encoded` becomes a
+            categorical feature, and the training matrix is a QuantileDMatrix: the features are
+            binned once into at most `max_bin` quantiles and the raw values are not kept, which
+            needs much less memory than a DMatrix. QuantileDMatrix requires the histogram method,
+            so the tree method is then 'hist' unless another one is given with `tree_method`.
+            The tree method only applies to this fit, `params` is left as is.
         """
 
         df_train_y = df_train[['WAIT_TIME_MAX']]
@@ -141,31 +196,243 @@ class Forecaster():
 
         # Final featuring
         df_train_x = self.featuring(df_train_x)
-        
-        # Convert to DMatrix (optional, but improves efficiency)
-        dtrain = xgb.DMatrix(df_train_x, label=df_train_y)
+
+        params = self.params
+        if tree_method is not None or quantile:
+            params = {**self.params, 'tree_method': tree_method or 'hist'}
+
+        if quantile:
+            dtrain = xgb.QuantileDMatrix(self.model_input(df_train_x, categorical=True), label=df_train_y, max_bin=max_bin, enable_categorical=True)
+        else:
+            # Convert to DMatrix (optional, but improves efficiency)
+            dtrain = xgb.DMatrix(df_train_x, label=df_train_y)
         #dval = xgb.DMatrix(df_val_x, label=df_val_y)
 
         evals = [(dtrain, "train")]#, (dval, "val")]
         
         # train model
-        self.model = xgb.train(self.params, dtrain, num_boost_round=1000, evals=evals, early_stopping_rounds=10)
-        #save_model(self.model, self.filename)
+        num_boost_round = num_boost_round or self.num_boost_round
+        self.model = xgb.train(params, dtrain, num_boost_round=num_boost_round, evals=evals, early_stopping_rounds=10)
+        self.data_scaling = None if scaling is None else scaling.copy()
+        source_dates = self.source_dates(df_train, scaling)
+        self.history = [{
+            "start": str(source_dates.min().date()),
+            "end": str(source_dates.max().date()),
+            "rows": len(df_train),
+            "rounds": self.model.num_boosted_rounds(),
+            "base_version": None,
+        }]
+
+    def model_input(self, X, categorical=None):
+        """
+            features as the booster expects them: float32, with `attraction_encoded` as a
+            categorical column when the booster was trained with categorical support
+        """
+        if categorical is None:
+            categorical = 'c' in (self.model.feature_types or [])
+        if not categorical:
+            return X
+        X = X.astype(np.float32)
+        X['attraction_encoded'] = pd.Categorical(X['attraction_encoded'].astype(int), categories=sorted(self.attraction_decoding))
+        return X
+
+    @staticmethod
+    def source_dates(df, scaling=None):
+        """
+            WORK_DATE of the rows before the merged data was moved to today, the dates stay
+            the same every time the pipeline runs while WORK_DATE moves with the day of the run
+
+            `scaling` is the merged_scaling of the DataLoader that built `df`, without it the
+            rows are taken as not shifted
+        """
+        days_shifted = 0 if scaling is None else int(scaling['days_shifted'].iloc[0])
+        return pd.to_datetime(df['WORK_DATE']) - pd.Timedelta(days=days_shifted)
+
+    def trained_until(self):
+        """
+            last source date (see source_dates()) seen by the current booster, None if unknown
+        """
+        ends = [entry["end"] for entry in self.history]
+        return pd.Timestamp(max(ends)) if ends else None
+
+    def update(self, df_new, num_boost_round=100, external_memory=False, cache_dir=None, scaling=None):
+        """
+            continues boosting the saved (or current) booster on the days it has not seen yet
+
+            `df_new` is a merged frame like the one given to fit(), or an iterable of such frames
+            (e.g. the chunks of a merge streamed from disk). Only the rows after the last source date
+            seen by the booster are kept, they are featured with the scaler of the booster, and
+            `num_boost_round` trees are added on top of the existing ones (xgb_model warm start).
+            With `external_memory`, the featured chunks are written to `cache_dir` and read back
+            by an external memory DMatrix, so the new rows never have to fit in RAM at once.
+
+            `scaling` is the merged_scaling of the DataLoader that built `df_new`: every run of the
+            pipeline moves the dates to its own day, so the rows are matched to the history on their
+            dates before that shift. It is required when the model was fitted on shifted data.
+
+            the date range of the new rows is appended to `history`, which is saved with the model
+        """
+        if getattr(self, 'model', None) is None:
+            self.load()
+        if scaling is None and self.data_scaling is not None:
+            raise ValueError("The model was fitted on shifted merged data, give update() the merged_scaling of the DataLoader of df_new")
+        if scaling is not None and self.data_scaling is not None:
+            columns = self.data_scaling.index.intersection(scaling.index)
+            if not np.allclose(self.data_scaling.loc[columns, ['min', 'scale']], scaling.loc[columns, ['min', 'scale']]):
+                print("Warning: the merged data of df_new is not scaled like the training data of the model")
+        if isinstance(df_new, pd.DataFrame):
+            df_new = [df_new]
+        trained_until = self.trained_until()
+        feature_names = self.model.feature_names
+        # parquet does not keep integer categories, the chunks are made categorical when they are read
+        prepare = lambda chunk: self.model_input(chunk[feature_names])
+
+        if cache_dir is None:
+            cache_dir = os.path.join(DataLoader().root_dir, "data", ".cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=cache_dir) as tmp:
+            chunks, start, end, rows = [], None, None, 0
+            for df in df_new:
+                source_dates = self.source_dates(df, scaling)
+                if trained_until is not None:
+                    new = source_dates > trained_until
+                    df, source_dates = df[new], source_dates[new]
+                if df.empty:
+                    continue
+                df = df.copy()
+                start = source_dates.min() if start is None else min(start, source_dates.min())
+                end = source_dates.max() if end is None else max(end, source_dates.max())
+                rows += len(df)
+
+                chunk = self.featuring(df.drop(columns=['WAIT_TIME_MAX']), train=False)[feature_names]
+                chunk['WAIT_TIME_MAX'] = df['WAIT_TIME_MAX'].to_numpy()
+                if external_memory:
+                    path = os.path.join(tmp, f"chunk_{len(chunks)}.parquet")
+                    chunk.to_parquet(path)
+                    chunk = path
+                chunks.append(chunk)
+
+            if not rows:
+                print(f"No waiting times after {trained_until.date()}, the model is up to date")
+                return self
+
+            if external_memory:
+                dtrain = xgb.DMatrix(_ParquetChunks(chunks, prepare, os.path.join(tmp, "dtrain")), enable_categorical=True)
+            else:
+                chunk = pd.concat(chunks, ignore_index=True)
+                dtrain = xgb.DMatrix(prepare(chunk), label=chunk['WAIT_TIME_MAX'], enable_categorical=True)
+
+            base_version = getattr(self, 'model_version', None)
+            self.model = xgb.train(self.params, dtrain, num_boost_round=num_boost_round, xgb_model=self.model)
+        if scaling is not None:
+            # predict_grid() follows the shift of the latest merged data
+            self.data_scaling = scaling.copy()
+
+        self.history.append({
+            "start": str(start.date()),
+            "end": str(end.date()),
+            "rows": rows,
+            "rounds": self.model.num_boosted_rounds(),
+            "base_version": base_version,
+        })
+        return self
+
+    def save(self, path=None):
+        """
+            saves the booster in XGBoost's native format (UBJ or JSON, from the extension of the path)
+            together with the scaler and the attraction encoding, stored as attributes of the booster,
+            so that the model is one versioned file that loads without pickle
+        """
+        if path is None:
+            path = os.path.join(DataLoader().root_dir, "models", self.filename)
+        metadata = {
+            "artifact_version": ARTIFACT_VERSION,
+            "xgboost_version": xgb.__version__,
+            "params": self.params,
+            "num_boost_round": self.num_boost_round,
+            "attraction_encoding": self.attraction_encoding,
+            "history": self.history,
+            "data_scaling": None if self.data_scaling is None else {
+                "columns": list(self.data_scaling.index), **self.data_scaling.to_dict(orient="list")
+            },
+            "scaler": {
+                "feature_range": list(self.scaler.feature_range),
+                "feature_names_in": list(self.scaler.feature_names_in_),
+                "n_samples_seen": int(self.scaler.n_samples_seen_),
+                **{attr: getattr(self.scaler, f"{attr}_").tolist() for attr in ("min", "scale", "data_min", "data_max", "data_range")},
+            },
+        }
+        self.model.set_attr(forecaster=json.dumps(metadata))
+        self.model.save_model(path)
+        self.model_version = hashlib.sha1(self.model.save_raw("ubj")).hexdigest()[:16]
+        return path
+
+    def load(self, path=None):
+        """
+            loads a booster saved by save(), with its scaler and attraction encoding
+        """
+        if path is None:
+            path = os.path.join(DataLoader().root_dir, "models", self.filename)
+        model = xgb.Booster()
+        model.load_model(path)
+        metadata = json.loads(model.attr("forecaster") or "{}")
+        if metadata.get("artifact_version") != ARTIFACT_VERSION:
+            raise ValueError(f"{path} is not a version {ARTIFACT_VERSION} wait time model")
+
+        scaler = MinMaxScaler(feature_range=tuple(metadata["scaler"]["feature_range"]))
+        scaler.feature_names_in_ = np.array(metadata["scaler"]["feature_names_in"], dtype=object)
+        scaler.n_features_in_ = len(scaler.feature_names_in_)
+        scaler.n_samples_seen_ = metadata["scaler"]["n_samples_seen"]
+        for attr in ("min", "scale", "data_min", "data_max", "data_range"):
+            setattr(scaler, f"{attr}_", np.array(metadata["scaler"][attr]))
+
+        self.model = model
+        self.scaler = scaler
+        self.params = metadata["params"]
+        self.num_boost_round = metadata.get("num_boost_round", 1000)
+        self.attraction_encoding = metadata["attraction_encoding"]
+        self.attraction_decoding = {code: attraction for attraction, code in self.attraction_encoding.items()}
+        self.history = metadata.get("history", [])
+        data_scaling = metadata.get("data_scaling")
+        self.data_scaling = None if data_scaling is None else pd.DataFrame(
+            {name: values for name, values in data_scaling.items() if name != "columns"}, index=data_scaling["columns"]
+        )
+        self.model_version = hashlib.sha1(model.save_raw("ubj")).hexdigest()[:16]
+        return self
+
+    def load_params(self, path=None):
+        """
+            loads the hyperparameters and the number of boosting rounds tuned by
+            wait_time_tuning.tune(), keeping the device of this machine, and returns the whole
+            artifact (version, cross-validation scores...)
+        """
+        if path is None:
+            path = os.path.join(DataLoader().root_dir, "models", "wait_time_params.json")
+        with open(path) as f:
+            artifact = json.load(f)
+        if artifact.get("artifact_version") != PARAMS_ARTIFACT_VERSION:
+            raise ValueError(f"{path} is not a version {PARAMS_ARTIFACT_VERSION} tuned parameters artifact")
+        self.params = {**artifact["params"], "device": self.params["device"]}
+        self.params_version = artifact["params_version"]
+        self.num_boost_round = artifact["num_boost_round"]
+        return artifact
 
     def predict(self, X, pivot=True, export=True):
         """
             predicts using the model
             need X to have DEB_TIME and WORK_DATE
         """
+        # Load the saved model if none was trained, featuring needs its scaler
+        if getattr(self, 'model', None) is None:
+            self.load()
+        model = self.model
+
         # Final featuring
         X = self.featuring(X, train=False)
 
         # create the input matrix of the model
         X_pred = X.drop(columns=['WORK_DATE', 'DEB_TIME'])
-        X_pred = xgb.DMatrix(X_pred)
-
-        # Load the saved model
-        model = self.model  #model = load_model(self.filename)
+        X_pred = xgb.DMatrix(self.model_input(X_pred), enable_categorical=True)
 
         # predict and merge predictions with X
         y_pred = model.predict(X_pred)
@@ -185,11 +452,73 @@ class Forecaster():
 
         return res
     
+    def predict_grid(self, start=None, days=5, attractions=None, features=None, freq='15min', chunksize=100_000, csv_name=None):
+        """
+            predicts the waiting times of every attraction at every slot of the forecast horizon at once
+
+            the (slot x attraction) grid is built directly as a float32 matrix: calendar features are
+            derived from the slots like in the merged data (from the hour of the slot before the date
+            shift, scaled with the data_scaling given to fit(), then by featuring()), the other features of the model are read from `features` (a frame
+            with a DEB_TIME column, and optionally ENTITY_DESCRIPTION_SHORT for per-attraction values)
+            and are left missing otherwise. The grid is predicted by chunks with inplace_predict, which
+            uses all the cores, and each chunk can be appended to a CSV as soon as it is predicted.
+
+            returns the (slot x attraction) matrix of predictions, the slots and the attraction names
+        """
+        if getattr(self, 'model', None) is None:
+            self.load()
+        if self.data_scaling is None:
+            raise ValueError("predict_grid() needs the scaling of the merged data, fit the model with scaling=DataLoader.merged_scaling")
+        if attractions is None:
+            attractions = list(self.attraction_encoding)
+        start = pd.Timestamp.today().normalize() if start is None else pd.Timestamp(start)
+        slots = pd.date_range(start, start + pd.Timedelta(days=days), freq=freq, inclusive='left')
+        n_slots, n_attractions = len(slots), len(attractions)
+
+        # calendar features of the slots, through the same scalings as the merged rows
+        shift = pd.Timedelta(days=int(self.data_scaling['days_shifted'].iloc[0]))
+        calendar = DataLoader.scale_merged(DataLoader.calendar_features((slots - shift).floor('h')), self.data_scaling)
+        calendar = self.featuring(calendar.assign(
+            WORK_DATE=slots.normalize(), DEB_TIME=slots, FIN_TIME=slots, DEB_TIME_HOUR=slots.hour,
+            ENTITY_DESCRIPTION_SHORT=attractions[0],
+        ), train=False)
+
+        # one row per (slot, attraction), slot-major so that chunks cover whole slots
+        grid = np.full((n_slots * n_attractions, len(self.model.feature_names)), np.nan, dtype=np.float32)
+        slot_features = pair_features = None
+        if features is not None and 'ENTITY_DESCRIPTION_SHORT' in features:
+            keys = pd.MultiIndex.from_product([slots, attractions])
+            pair_features = features.drop_duplicates(['DEB_TIME', 'ENTITY_DESCRIPTION_SHORT']).set_index(['DEB_TIME', 'ENTITY_DESCRIPTION_SHORT']).reindex(keys)
+        elif features is not None:
+            slot_features = features.drop_duplicates('DEB_TIME').set_index('DEB_TIME').reindex(slots)
+        for j, name in enumerate(self.model.feature_names):
+            if name == 'attraction_encoded':
+                grid[:, j] = np.tile([self.attraction_encoding[attraction] for attraction in attractions], n_slots)
+            elif name in calendar:
+                grid[:, j] = np.repeat(calendar[name].to_numpy(), n_attractions)
+            elif slot_features is not None and name in slot_features:
+                grid[:, j] = np.repeat(slot_features[name].to_numpy(dtype=np.float32), n_attractions)
+            elif pair_features is not None and name in pair_features:
+                grid[:, j] = pair_features[name].to_numpy(dtype=np.float32)
+
+        predictions = np.empty((n_slots, n_attractions), dtype=np.float32)
+        rows = max(chunksize // n_attractions, 1) * n_attractions
+        path = None if csv_name is None else os.path.join(DataLoader().root_dir, csv_name)
+        for first in range(0, len(grid), rows):
+            chunk = self.model.inplace_predict(grid[first:first + rows]).reshape(-1, n_attractions)
+            first_slot = first // n_attractions
+            predictions[first_slot:first_slot + len(chunk)] = chunk
+            if path is not None:
+                pd.DataFrame(chunk, index=slots[first_slot:first_slot + len(chunk)], columns=attractions).rename_axis('DEB_TIME').to_csv(
+                    path, mode='w' if first == 0 else 'a', header=first == 0
+                )
+        return predictions, slots, attractions
+
     def pivot(self,df):
         """
             pivoting the results on the attractions to get the right format for plotting.
         """
-        df['attraction'] = df['attraction_encoded'].apply(lambda x: self.attraction_decoding[x])
+        df['attraction'] = df['attraction_encoded'].map(self.attraction_decoding)
         df = df.drop(columns=['attraction_encoded'])
         df_pivot = df.pivot(index='DEB_TIME', columns='attraction', values='PRED')
         return df_pivot
@@ -201,3 +530,197 @@ class Forecaster():
         root_dir = DataLoader().root_dir
         os.path.join(root_dir,csv_name)
         df.to_csv(csv_name)
+
+
+def _fit_shard(df_train, params, scaling=None):
+    """fits the Forecaster of one shard, in a worker process"""
+    forecaster = Forecaster()
+    forecaster.params.update(params)
+    forecaster.fit(df_train, scaling=scaling)
+    return forecaster
+
+
+class ShardedForecaster():
+    """
+        one Forecaster per attraction, or per group of attractions, instead of a single booster
+
+        the shards are trained in parallel worker processes, predictions are routed to the shard
+        of their ENTITY_DESCRIPTION_SHORT, and the fingerprint of the training rows of every shard
+        is kept so that fit(only_changed=True) retrains only the shards whose data changed.
+        The shards are saved as native boosters next to a shards.json manifest.
+    """
+
+    def __init__(self, shards=None, dirname='wait_time_shards', csv_name='waiting_time_predicted.csv'):
+        """
+            `shards` maps a shard name to its attractions, one shard per attraction of the
+            training data by default
+        """
+        self.shards = shards
+        self.dirname = dirname
+        self.csv_name = csv_name
+        self.forecasters = {}
+        self.fingerprints = {}
+
+    def _routes(self):
+        return {attraction: shard for shard, attractions in self.shards.items() for attraction in attractions}
+
+    def fit(self, df_train, max_workers=None, only_changed=False, scaling=None, mp_context=None):
+        """
+            fits the shards in a process pool and returns the names of the refitted shards,
+            `scaling` is given to Forecaster.fit()
+
+            the workers are started with `mp_context` (a multiprocessing context or start method
+            name), the default start method of the platform if None
+
+            with `only_changed`, the shards whose training rows have the same fingerprint as
+            when they were last fitted are kept as they are
+        """
+        attractions = df_train['ENTITY_DESCRIPTION_SHORT'].astype(str)
+        if self.shards is None:
+            self.shards = {attraction: [attraction] for attraction in sorted(attractions.unique())}
+        shard_of = attractions.map(self._routes())
+
+        frames, fingerprints = {}, {}
+        for shard, df in df_train.groupby(shard_of.to_numpy(), sort=False):
+            frames[shard] = df
+            fingerprints[shard] = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()[:16]
+        if only_changed:
+            frames = {shard: df for shard, df in frames.items() if fingerprints[shard] != self.fingerprints.get(shard)}
+        if not frames:
+            return []
+
+        max_workers = min(max_workers or os.cpu_count(), len(frames))
+        # the cores are shared between the workers
+        params = {"n_jobs": max(os.cpu_count() // max_workers, 1)}
+        if mp_context is None or isinstance(mp_context, str):
+            mp_context = multiprocessing.get_context(mp_context)
+        with ProcessPoolExecutor(max_workers, mp_context=mp_context) as pool:
+            futures = {shard: pool.submit(_fit_shard, df, params, scaling) for shard, df in frames.items()}
+            for shard, future in futures.items():
+                self.forecasters[shard] = future.result()
+                self.forecasters[shard].params["n_jobs"] = -1
+                self.fingerprints[shard] = fingerprints[shard]
+        return list(frames)
+
+    def save(self, dirpath=None):
+        """
+            saves every shard with Forecaster.save() and the manifest of the shards
+        """
+        if dirpath is None:
+            dirpath = os.path.join(DataLoader().root_dir, "models", self.dirname)
+        os.makedirs(dirpath, exist_ok=True)
+        manifest = {}
+        for shard, forecaster in self.forecasters.items():
+            filename = f"shard_{hashlib.sha1(shard.encode()).hexdigest()[:12]}.ubj"
+            forecaster.save(os.path.join(dirpath, filename))
+            manifest[shard] = {
+                "attractions": self.shards[shard],
+                "file": filename,
+                "fingerprint": self.fingerprints[shard],
+                "model_version": forecaster.model_version,
+            }
+        with open(os.path.join(dirpath, "shards.json.tmp"), "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(os.path.join(dirpath, "shards.json.tmp"), os.path.join(dirpath, "shards.json"))
+        return dirpath
+
+    def load(self, dirpath=None):
+        """
+            loads the shards saved by save()
+        """
+        if dirpath is None:
+            dirpath = os.path.join(DataLoader().root_dir, "models", self.dirname)
+        with open(os.path.join(dirpath, "shards.json")) as f:
+            manifest = json.load(f)
+        self.shards = {shard: entry["attractions"] for shard, entry in manifest.items()}
+        self.fingerprints = {shard: entry["fingerprint"] for shard, entry in manifest.items()}
+        self.forecasters = {shard: Forecaster().load(os.path.join(dirpath, entry["file"])) for shard, entry in manifest.items()}
+        return self
+
+    def predict(self, X, pivot=True, export=True):
+        """
+            predicts every row with the shard of its attraction, same output as Forecaster.predict()
+        """
+        if not self.forecasters:
+            self.load()
+        shard_of = X['ENTITY_DESCRIPTION_SHORT'].astype(str).map(self._routes())
+        if shard_of.isna().any():
+            raise ValueError(f"No shard for the attractions {sorted(X.loc[shard_of.isna(), 'ENTITY_DESCRIPTION_SHORT'].astype(str).unique())}")
+        # rows are put back in the order of X by position, the index of X may have duplicates
+        shard_of = shard_of.to_numpy()
+        positions, parts = [], []
+        for shard in pd.unique(shard_of):
+            rows = np.flatnonzero(shard_of == shard)
+            positions.append(rows)
+            parts.append(self.forecasters[shard].predict(X.iloc[rows].copy(), pivot=False, export=False))
+        res = pd.concat(parts).iloc[np.argsort(np.concatenate(positions), kind='stable')]
+
+        forecaster = next(iter(self.forecasters.values()))
+        if pivot:
+            res = forecaster.pivot(res)
+        if export:
+            forecaster.export(res, self.csv_name)
+        return res
+
+def _benchmark_run(df_train, fit_kwargs, results):
+    # Unix only, imported here so that the module still loads on Windows
+    import resource
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    forecaster = Forecaster()
+    forecaster.fit(df_train, **fit_kwargs)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux; the memory of the process before fitting is subtracted
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    results.put((seconds, peak / 1024, forecaster.model.num_boosted_rounds()))
+
+
+def benchmark_fit(df_train, paths=None, mp_context=None):
+    """
+        compares the training paths of the Forecaster on the same merged frame
+
+        every path is fitted in a fresh process, so that the peak RSS of one path does not
+        hide the one of the next. `paths` maps a name to the keyword arguments of fit(), by default
+        the DMatrix path against the QuantileDMatrix path. The processes are started with
+        `mp_context` (a context or start method name), the default one of the platform if None.
+        The peak RSS needs the resource module, i.e. a Unix system.
+
+        returns a frame with the training time, the peak RSS added by the training and the number
+        of boosting rounds of each path
+    """
+    if paths is None:
+        paths = {"DMatrix": {}, "QuantileDMatrix (hist)": {"quantile": True}}
+    if mp_context is None or isinstance(mp_context, str):
+        mp_context = multiprocessing.get_context(mp_context)
+    rows = {}
+    for name, fit_kwargs in paths.items():
+        results = mp_context.Queue()
+        process = mp_context.Process(target=_benchmark_run, args=(df_train, fit_kwargs, results))
+        process.start()
+        rows[name] = results.get()
+        process.join()
+    return pd.DataFrame.from_dict(rows, orient="index", columns=["seconds", "peak_rss_mb", "rounds"])
+
+
+def benchmark_sharding(df_train, df_test, shards=None, max_workers=None, mp_context=None):
+    """
+        compares the global Forecaster with a ShardedForecaster on the same train / test split
+
+        returns a frame with the training time, the prediction time of `df_test`, and the RMSE
+        and MAE of the predictions of both modes
+    """
+    rows = {}
+    for name, model in (("global", Forecaster()), ("sharded", ShardedForecaster(shards))):
+        start = time.perf_counter()
+        if name == "global":
+            model.fit(df_train.copy())
+        else:
+            model.fit(df_train, max_workers=max_workers, mp_context=mp_context)
+        fit_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        pred = model.predict(df_test.drop(columns=['WAIT_TIME_MAX']), pivot=False, export=False)['PRED']
+        predict_seconds = time.perf_counter() - start
+        error = pred.to_numpy() - df_test['WAIT_TIME_MAX'].to_numpy()
+        rows[name] = (fit_seconds, predict_seconds, np.sqrt(np.mean(error ** 2)), np.mean(np.abs(error)))
+    return pd.DataFrame.from_dict(rows, orient="index", columns=["fit_seconds", "predict_seconds", "rmse", "mae"])
+
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from endless_line.data_utils.dataloader import DataLoader
+from endless_line.models.wait_time_model import PARAMS_ARTIFACT_VERSION, Forecaster
+
+# Sampled hyperparameters: (kind, low, high), "log" ranges are sampled log-uniformly
+SEARCH_SPACE = {
+    "max_depth": ("int", 3, 10),
+    "learning_rate": ("log", 0.005, 0.3),
+    "subsample": ("float", 0.5, 1.0),
+    "colsample_bytree": ("float", 0.5, 1.0),
+    "min_child_weight": ("log", 0.1, 10.0),
+    "lambda": ("log", 0.01, 10.0),
+    "alpha": ("log", 0.01, 10.0),
+    "gamma": ("float", 0.0, 1.0),
+}
+
+# Feature matrix of the worker processes, memory-mapped from the files written by tune()
+_features = {}
+
+
+def time_series_folds(work_dates, n_splits=3):
+    """
+    Expanding-window folds over days: the days are cut into `n_splits + 1` consecutive blocks,
+    and fold k trains on the blocks up to k and validates on block k + 1.
+
+    Args:
+        work_dates (pd.Series): WORK_DATE of the rows, sorted.
+        n_splits (int): Number of folds.
+
+    Returns:
+        list: (train_stop, val_stop) row positions of every fold, the rows of fold k being
+            [0, train_stop) for training and [train_stop, val_stop) for validation.
+    """
+    dates = pd.to_datetime(work_dates).to_numpy()
+    days = np.unique(dates)
+    if len(days) < n_splits + 1:
+        raise ValueError(f"{len(days)} days cannot be cut into {n_splits} time series folds")
+    bounds = [days[len(days) * k // (n_splits + 1)] for k in range(1, n_splits + 1)] + [None]
+    stops = [int(np.searchsorted(dates, bound)) if bound is not None else len(dates) for bound in bounds]
+    return list(zip(stops[:-1], stops[1:]))
+
+
+def sample_params(rng, search_space=SEARCH_SPACE):
+    """Draw one set of hyperparameters from the search space."""
+    params = {}
+    for name, (kind, low, high) in search_space.items():
+        if kind == "int":
+            params[name] = int(rng.integers(low, high + 1))
+        elif kind == "log":
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            params[name] = float(rng.uniform(low, high))
+    return params
+
+
+def _open_features(features_path, labels_path, feature_names):
+    """Initializer of the worker processes: map the shared feature matrix, read-only."""
+    _features["X"] = np.load(features_path, mmap_mode="r")
+    _features["y"] = np.load(labels_path, mmap_mode="r")
+    _features["feature_names"] = feature_names
+
+
+def _run_trial(trial, params, folds, num_boost_round, early_stopping_rounds):
+    """Cross-validate one set of parameters on the memory-mapped features of the worker."""
+    X, y, feature_names = _features["X"], _features["y"], _features["feature_names"]
+    start = time.perf_counter()
+    scores, rounds = [], []
+    for train_stop, val_stop in folds:
+        # the rows are sorted by day, so the folds are slices, i.e. views of the mapped file
+        dtrain = xgb.QuantileDMatrix(X[:train_stop], label=y[:train_stop], feature_names=feature_names)
+        dval = xgb.QuantileDMatrix(X[train_stop:val_stop], label=y[train_stop:val_stop], feature_names=feature_names, ref=dtrain)
+        model = xgb.train(
+            params, dtrain, num_boost_round=num_boost_round, evals=[(dval, "val")],
+            early_stopping_rounds=early_stopping_rounds, verbose_eval=False,
+        )
+        scores.append(model.best_score)
+        rounds.append(model.best_iteration + 1)
+    return {
+        "trial": trial,
+        "rmse": float(np.mean(scores)),
+        "fold_rmse": scores,
+        "best_rounds": rounds,
+        "seconds": time.perf_counter() - start,
+        "params": params,
+    }
+
+
+def tune(merged=None, n_trials=20, n_splits=3, max_workers=None, num_boost_round=1000,
+         early_stopping_rounds=10, seed=0, search_space=SEARCH_SPACE, path=None):
+    """
+    Random search of the XGBoost hyperparameters of the Forecaster, with time series
+    cross-validation.
+
+    The merged data is featured once, sorted by day and written as a float32 .npy file that
+    every worker of the process pool memory-maps, so the feature matrix is in memory once
+    whatever the number of workers. Every trial trains one booster per fold with early stopping
+    on the validation days, and is scored by its mean validation RMSE. The best parameters are
+    saved as a versioned artifact, see `Forecaster.load_params()`.
+
+    Args:
+        merged (pd.DataFrame, optional): Output of DataLoader.merge(), computed with run_pipeline() by default.
+        n_trials (int): Number of sampled parameter sets.
+        n_splits (int): Number of time series folds.
+        max_workers (int, optional): Size of the process pool, the number of CPUs by default.
+        num_boost_round (int): Maximum number of boosting rounds of a fold.
+        early_stopping_rounds (int): Rounds without improvement of the validation RMSE before a fold stops.
+        seed (int): Seed of the parameter sampling, the same seed gives the same trials.
+        search_space (dict): Sampled hyperparameters, see SEARCH_SPACE.
+        path (str, optional): Where to save the best parameters, models/wait_time_params.json by default.
+            The artifact is also kept as wait_time_params.<version>.json next to it.
+
+    Returns:
+        tuple: The trials (pd.DataFrame, best first) and the saved artifact (dict).
+    """
+    loader = DataLoader()
+    if merged is None:
+        loader.run_pipeline()
+        merged = loader.merged
+    forecaster = Forecaster()
+    merged = merged[merged["ENTITY_DESCRIPTION_SHORT"].isin(forecaster.attraction_encoding)]
+    merged = merged.assign(WORK_DATE=pd.to_datetime(merged["WORK_DATE"])).sort_values("WORK_DATE", kind="stable")
+    folds = time_series_folds(merged["WORK_DATE"], n_splits)
+
+    X = forecaster.featuring(merged.drop(columns=["WAIT_TIME_MAX"]))
+    feature_names = list(X.columns)
+    max_workers = max_workers or os.cpu_count()
+    base_params = {
+        **forecaster.params,
+        "tree_method": "hist",
+        # the cores are shared between the workers
+        "n_jobs": max(os.cpu_count() // max_workers, 1),
+    }
+    rng = np.random.default_rng(seed)
+    trials = [{**base_params, **sample_params(rng, search_space)} for _ in range(n_trials)]
+
+    cache_dir = os.path.join(loader.root_dir, "data", ".cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as tmp:
+        features_path, labels_path = os.path.join(tmp, "X.npy"), os.path.join(tmp, "y.npy")
+        np.save(features_path, X.to_numpy(dtype=np.float32))
+        np.save(labels_path, merged["WAIT_TIME_MAX"].to_numpy(dtype=np.float32))
+        del X
+
+        with ProcessPoolExecutor(max_workers, initializer=_open_features, initargs=(features_path, labels_path, feature_names)) as pool:
+            futures = [
+                pool.submit(_run_trial, trial, params, folds, num_boost_round, early_stopping_rounds)
+                for trial, params in enumerate(trials)
+            ]
+            results = [future.result() for future in futures]
+
+    results = pd.DataFrame(results).sort_values("rmse", kind="stable").reset_index(drop=True)
+    best = results.iloc[0]
+    params = {name: value for name, value in best["params"].items() if name not in ("n_jobs", "tree_method")}
+    params["n_jobs"] = forecaster.params["n_jobs"]
+    artifact = {
+        "artifact_version": PARAMS_ARTIFACT_VERSION,
+        "params_version": hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16],
+        "created": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "xgboost_version": xgb.__version__,
+        "params": params,
+        "num_boost_round": int(np.mean(best["best_rounds"])),
+        "cv_rmse": best["rmse"],
+        "fold_rmse": best["fold_rmse"],
+        "search": {"n_trials": n_trials, "n_splits": n_splits, "seed": seed, "search_space": search_space},
+        "data": {
+            "start": str(merged["WORK_DATE"].min().date()),
+            "end": str(merged["WORK_DATE"].max().date()),
+            "rows": len(merged),
+        },
+    }
+    save_params(artifact, path)
+    return results, artifact
+
+
+def save_params(artifact, path=None):
+    """
+    Write a tuned parameters artifact to `path`, and keep a copy named after its version.
+
+    Returns:
+        str: The path of the artifact.
+    """
+    if path is None:
+        path = os.path.join(DataLoader().root_dir, "models", "wait_time_params.json")
+    root, ext = os.path.splitext(path)
+    for target in (f"{root}.{artifact['params_version']}{ext}", path):
+        with open(target + ".tmp", "w") as f:
+            json.dump(artifact, f, indent=4)
+        os.replace(target + ".tmp", target)
+    return path
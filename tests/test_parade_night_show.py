@@ -0,0 +1,61 @@
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from endless_line.data_utils.dataloader import DataLoader
+
+
+def clean_parade_night_show_reference(loader, parade_night_show):
+	"""The per-row implementation of `DataLoader.clean_parade_night_show()` it was vectorized from."""
+	parade_night_show = parade_night_show[(parade_night_show['WORK_DATE'] < '2020-01-01') | (parade_night_show['WORK_DATE'] >= '2022-01-01')]
+
+	parade_night_show_night_show = parade_night_show[["WORK_DATE", "NIGHT_SHOW"]].rename(columns={"NIGHT_SHOW": 'show_or_parade'})
+	parade_night_show_parade_1 = parade_night_show[["WORK_DATE", "PARADE_1"]].rename(columns={"PARADE_1": 'show_or_parade'})
+	parade_night_show_parade_2 = parade_night_show[["WORK_DATE", "PARADE_2"]].rename(columns={"PARADE_2": 'show_or_parade'})
+	parade_night_show_ = pd.concat([parade_night_show_night_show, parade_night_show_parade_1, parade_night_show_parade_2])
+	parade_night_show_ = parade_night_show_.dropna(subset=['show_or_parade'])
+
+	parade_night_show_15 = parade_night_show_.copy()
+	parade_night_show_30 = parade_night_show_.copy()
+	round_times = [00, 15, 30, 45]
+	parade_night_show_30 = parade_night_show_30[parade_night_show_30['show_or_parade'].apply(lambda t: t.minute not in round_times)]
+	time_change_15 = timedelta(minutes=15)
+	time_change_30 = timedelta(minutes=30)
+	parade_night_show_15['show_or_parade'] = parade_night_show_15['show_or_parade'].apply(
+		lambda t: (datetime.combine(datetime.today(), t) + time_change_15).time()
+	)
+	parade_night_show_30['show_or_parade'] = parade_night_show_30['show_or_parade'].apply(
+		lambda t: (datetime.combine(datetime.today(), t) + time_change_30).time()
+	)
+	parade_night_show_ = pd.concat([parade_night_show_, parade_night_show_15, parade_night_show_30])
+	parade_night_show_['show_or_parade'] = parade_night_show_.apply(lambda row: pd.to_datetime(f"{row['WORK_DATE'].date()} {row['show_or_parade']}"), axis=1).astype('datetime64[s]')
+	parade_night_show_['show_or_parade'] = parade_night_show_['show_or_parade'].apply(lambda dt: loader.round_to_quarter(dt, down=True))
+	parade_night_show_['WORK_DATE'] = parade_night_show_['WORK_DATE'].astype('datetime64[s]')
+	return parade_night_show_.copy()
+
+
+@pytest.fixture
+def parade_night_show():
+	return pd.DataFrame({
+		'WORK_DATE': pd.to_datetime([
+			'2019-06-01', '2019-06-02', '2019-06-03', '2020-06-01', '2022-01-01', '2022-01-02', '2022-07-14', '2023-12-31',
+		]),
+		# non-quarter minutes, seconds, the midnight wrap, times close to midnight and missing shows
+		'NIGHT_SHOW': [time(21, 0), time(22, 7), time(23, 50), time(21, 0), time(23, 45, 30), np.nan, time(23, 59, 59), time(0, 5)],
+		'PARADE_1': [time(12, 0), time(12, 14, 59), np.nan, time(12, 0), time(13, 1), time(17, 30, 10), np.nan, time(11, 15)],
+		'PARADE_2': [np.nan, time(16, 44), time(16, 45), np.nan, np.nan, time(23, 31), time(0, 0), np.nan],
+	})
+
+
+def test_clean_parade_night_show_matches_reference(parade_night_show):
+	loader = DataLoader(cache=False)
+	expected = clean_parade_night_show_reference(loader, parade_night_show.copy())
+
+	loader.parade_night_show = parade_night_show.copy()
+	loader.clean_parade_night_show()
+	result = loader.parade_night_show
+
+	assert len(result) > len(parade_night_show)
+	pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,91 @@
+import os
+from collections import Counter
+
+import boto3
+import pytest
+
+from endless_line.data_utils.remote_store import RemoteStore
+
+mock_aws = pytest.importorskip("moto").mock_aws
+
+BUCKET = "endless-line"
+
+
+@pytest.fixture
+def client():
+	with mock_aws():
+		client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test")
+		client.create_bucket(Bucket=BUCKET)
+		client.put_object(Bucket=BUCKET, Key="waiting_times.csv", Body=b"a,b\n1,2\n")
+		yield client
+
+
+@pytest.fixture
+def calls(client):
+	"""Number of requests sent by the client, by operation."""
+	calls = Counter()
+	client.meta.events.register("before-call.s3.*", lambda model, **kwargs: calls.update([model.name]))
+	return calls
+
+
+def store(client, tmp_path, ttl=0):
+	return RemoteStore(BUCKET, client, str(tmp_path / "mirror"), ttl=ttl)
+
+
+def test_exists_uses_head(client, calls, tmp_path):
+	remote = store(client, tmp_path)
+	assert remote.exists("waiting_times.csv")
+	assert not remote.exists("missing.csv")
+	assert calls == Counter({"HeadObject": 2})
+
+
+def test_fetch_downloads_only_when_the_etag_changes(client, calls, tmp_path):
+	remote = store(client, tmp_path)
+	path = remote.fetch("waiting_times.csv")
+	assert open(path, "rb").read() == b"a,b\n1,2\n"
+	assert calls["GetObject"] == 1
+
+	# same ETag: a HEAD request and no download
+	assert remote.fetch("waiting_times.csv") == path
+	assert calls["GetObject"] == 1
+	assert calls["HeadObject"] == 2
+
+	client.put_object(Bucket=BUCKET, Key="waiting_times.csv", Body=b"a,b\n3,4\n")
+	remote.fetch("waiting_times.csv")
+	assert calls["GetObject"] == 2
+	assert open(path, "rb").read() == b"a,b\n3,4\n"
+
+
+def test_ttl_skips_the_head_request(client, calls, tmp_path):
+	remote = store(client, tmp_path, ttl=3600)
+	remote.fetch("waiting_times.csv")
+	remote.fetch("waiting_times.csv")
+	with remote.open("waiting_times.csv") as f:
+		assert f.read() == b"a,b\n1,2\n"
+	assert calls == Counter({"HeadObject": 1, "GetObject": 1})
+
+
+def test_missing_key_raises_value_error(client, tmp_path):
+	remote = store(client, tmp_path)
+	with pytest.raises(ValueError):
+		remote.fetch("missing.csv")
+	with pytest.raises(ValueError):
+		with remote.open("missing.csv"):
+			pass
+
+
+def test_partially_read_open_leaves_a_complete_copy(client, calls, tmp_path):
+	body = os.urandom(3 << 20)
+	client.put_object(Bucket=BUCKET, Key="weather_data.csv", Body=body)
+	remote = store(client, tmp_path)
+	with remote.open("weather_data.csv") as f:
+		assert f.read(10) == body[:10]
+
+	path = os.path.join(remote.cache_dir, "weather_data.csv")
+	assert open(path, "rb").read() == body
+	assert not [name for name in os.listdir(remote.cache_dir) if name.endswith(".tmp")]
+
+	# the copy is complete and its ETag recorded, so it is not downloaded again
+	with remote.open("weather_data.csv") as f:
+		assert f.read() == body
+	assert calls["GetObject"] == 1
@@ -0,0 +1,80 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from endless_line.data_utils.dataloader import DataLoader
+
+pytest.importorskip("torch")
+pytest.importorskip("matplotlib")
+from endless_line.models.wait_time_model import Forecaster
+
+ATTRACTIONS = ['Spiral Slide', 'Giant Wheel', 'Roller Coaster']
+
+
+def merged_loader(target_date=None):
+	"""A loader whose merged data went through `scale_and_move_to_2025()`, like the pipeline run on `target_date`."""
+	rng = np.random.default_rng(0)
+	slots = pd.DatetimeIndex([
+		day + pd.Timedelta(minutes=15 * quarter)
+		for day in pd.date_range('2021-12-06', '2021-12-12')
+		for quarter in range(9 * 4, 20 * 4)
+	])
+	merged = pd.DataFrame({
+		'DEB_TIME': np.repeat(slots, len(ATTRACTIONS)),
+		'ENTITY_DESCRIPTION_SHORT': np.tile(ATTRACTIONS, len(slots)),
+	})
+	merged['WORK_DATE'] = merged['DEB_TIME'].dt.normalize()
+	merged['FIN_TIME'] = merged['DEB_TIME'] + pd.Timedelta(minutes=15)
+	merged['DEB_TIME_HOUR'] = merged['DEB_TIME'].dt.hour
+	for column in [
+		'GUEST_CARRIED', 'ADJUST_CAPACITY', 'OPEN_TIME', 'UP_TIME', 'DOWNTIME', 'NB_MAX_UNIT', 'Num_parade', 'NB_UNITS',
+		'temp', 'feels_like', 'pressure', 'wind_speed', 'clouds_all', 'weather_description_encoded', 'weather_main_encoded', 'attendance',
+	]:
+		merged[column] = rng.normal(100, 20, len(merged))
+	# the merged calendar features come from the hourly weather
+	calendar = DataLoader.calendar_features(merged['DEB_TIME'].dt.floor('h'))
+	merged[calendar.columns] = calendar
+	merged['WAIT_TIME_MAX'] = (
+		merged['ENTITY_DESCRIPTION_SHORT'].map({attraction: 10 * i for i, attraction in enumerate(ATTRACTIONS)})
+		+ 3 * merged['DEB_TIME'].dt.hour + 5 * merged['is_weekend'] + rng.normal(0, 2, len(merged))
+	)
+
+	loader = DataLoader(cache=False)
+	if target_date is not None:
+		loader._target_date = lambda: target_date
+	loader.merged = merged
+	loader.scale_and_move_to_2025()
+	return loader
+
+
+@pytest.fixture
+def loader():
+	return merged_loader()
+
+
+def test_predict_grid_matches_predict(loader):
+	forecaster = Forecaster()
+	forecaster.fit(loader.merged.copy(), scaling=loader.merged_scaling)
+
+	day = pd.Timestamp(loader.merged['WORK_DATE'].max()) - pd.Timedelta(days=1)
+	X = loader.merged[pd.to_datetime(loader.merged['WORK_DATE']) >= day].drop(columns=['WAIT_TIME_MAX'])
+	expected = forecaster.predict(X.copy(), export=False)[ATTRACTIONS]
+
+	predictions, slots, attractions = forecaster.predict_grid(day, days=2, attractions=ATTRACTIONS, features=X)
+	np.testing.assert_allclose(predictions[slots.get_indexer(expected.index)], expected.to_numpy(), rtol=1e-5)
+
+
+def test_update_skips_days_seen_in_an_earlier_run():
+	first = merged_loader(date(2026, 10, 10))
+	forecaster = Forecaster()
+	forecaster.fit(first.merged.copy(), scaling=first.merged_scaling)
+	rounds = forecaster.model.num_boosted_rounds()
+	assert forecaster.trained_until() == pd.Timestamp('2021-12-12')
+
+	# the same days, moved to another day by a later run of the pipeline
+	later = merged_loader(date(2026, 10, 17))
+	forecaster.update(later.merged.copy(), scaling=later.merged_scaling)
+	assert forecaster.model.num_boosted_rounds() == rounds
+	assert len(forecaster.history) == 1